@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the benchmark of the hot path of the project (topword, extra, linearplot, greyword and network)
+it runs every case against the bundled input ('TestSuite', 'LargeFile', 'network')
+and synthetic corpora of different number of chunks and vocabulary size,
+each case runs in its own process, so that the peak memory of a case is not affected by the others.
+
+usage:
+    python benchmark.py                                 run all the cases, write the result to benchmark.json
+    python benchmark.py --filter testall                only run the cases whose name contain 'testall'
+    python benchmark.py --save-baseline                 also save the result as the baseline
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.25
+                                                        compare to the baseline, a case is a regression if
+                                                        it is 25% slower (or uses 25% more memory) than the baseline
+    python benchmark.py --imports-only                  only check the import time of the modules (see checkimports())
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import resource
+import argparse
+import platform
+from multiprocessing import Process, Queue
+
+Root = os.path.dirname(os.path.abspath(__file__))
+TestAllOptions = ['CustomP', 'CustomF', 'TopStdE', 'MidStdE', 'LowStdE', 'TopIQR', 'MidIQR', 'LowIQR']
+SyntheticScales = [(10, 1000), (100, 1000), (100, 10000), (1000, 10000)]  # (number of chunk, vocabulary size)
+SyntheticChunkSize = 2000  # number of word in each synthetic chunk
+# the most seconds importing each module can take, and the slow packages it must not import
+# (scipy and matplotlib are only imported on first use, a batch job counting words should not pay for them)
+ImportBudgets = {'extra': 0.2, 'topword': 0.25, 'wordmatrix': 0.2, 'corpus': 0.25, 'corpusstats': 0.25}
+LazyPackages = ['scipy', 'matplotlib']
+
+
+def readfile(*path):
+    with open(os.path.join(Root, *path), 'r') as file:
+        return file.read()
+
+
+def testsuite():
+    """
+    :return: the WordLists of the files in 'TestSuite' (in the order of the file name)
+    """
+    from extra import loadstastic
+    return [loadstastic(readfile('TestSuite', name)) for name in sorted(os.listdir(os.path.join(Root, 'TestSuite')))]
+
+
+def synthetic(NumChunk, NumWord, ChunkSize=SyntheticChunkSize, seed=0):
+    """
+    make a synthetic corpus, the words follow zipf's law like a real text
+
+    :param NumChunk: the number of chunk
+    :param NumWord: the size of the vocabulary
+    :param ChunkSize: the number of word in each chunk
+    :return: the WordLists of the corpus
+    """
+    import numpy as np
+    Random = np.random.RandomState(seed)
+    Probability = 1 / np.arange(1, NumWord + 1)
+    Probability /= Probability.sum()
+    WordLists = []
+    for i in range(NumChunk):
+        Counts = np.bincount(Random.choice(NumWord, ChunkSize, p=Probability), minlength=NumWord)
+        WordLists.append(dict(('w' + str(word), int(Counts[word])) for word in np.nonzero(Counts)[0]))
+    return WordLists
+
+
+def wordcount(WordLists):
+    return sum(sum(wordlist.values()) for wordlist in WordLists)
+
+
+# each setup function prepares the input (not timed), and returns (the function to time, the number of item it handles)
+# the cases are listed in makecases()
+
+def setup_loadstastic(name):
+    from extra import loadstastic
+    content = readfile('LargeFile', name)
+    return (lambda: loadstastic(content)), len(content.split())
+
+
+def setup_merge_list(WordLists):
+    from extra import merge_list
+    return (lambda: merge_list(WordLists)), wordcount(WordLists)
+
+
+def setup_dicttomatrix(WordLists):
+    from extra import dicttomatrix
+    return (lambda: dicttomatrix(WordLists)), wordcount(WordLists)
+
+
+def setup_information(WordLists):
+    from extra import Files_Information, Word_Information
+    FileNames = ['file' + str(i) for i in range(len(WordLists))]
+    return (lambda: [Files_Information(WordLists, FileNames)] +
+            [Word_Information(wordlist, name) for wordlist, name in zip(WordLists, FileNames)]), len(WordLists)
+
+
+def setup_testall(WordLists, option, vectorize):
+    from topword import testall
+    Low, High = (1, 50) if option == 'CustomF' else (0.0, 1.0)
+    return (lambda: testall(WordLists, option, Low, High, vectorize=vectorize)), wordcount(WordLists)
+
+
+def setup_testgroup(WordLists, NumGroup, vectorize):
+    from topword import testgroup
+    Group = [WordLists[i::NumGroup] for i in range(NumGroup)]
+    return (lambda: testgroup(Group, option='TopStdE', vectorize=vectorize)), wordcount(WordLists) * (NumGroup - 1)
+
+
+def setup_reduceplot(method):
+    from linearplot import reduceplot, rollingwindow
+    Data = rollingwindow(readfile('LargeFile', 'moby_dick.txt').split(), ['the'], 101)[('the', 101)]
+    if method == 'r':
+        Data = Data.tolist()
+    return (lambda: reduceplot(Data, method=method)), len(Data)
+
+
+def setup_rollingztest():
+    from linearplot import rollingztest
+    Tokens = readfile('LargeFile', 'moby_dick.txt').split()
+    return (lambda: rollingztest(Tokens, ['the', 'whale', 'sea', 'ahab'], 1000, threshold=1e-6)), len(Tokens) * 4
+
+
+def setup_greyword():
+    from greyword import greyword
+    Contents = [readfile('TestSuite', name) for name in sorted(os.listdir(os.path.join(Root, 'TestSuite')))]
+    return (lambda: greyword(Contents)), sum(len(content.split()) for content in Contents)
+
+
+def setup_makenetwork():
+    from network import makenetwork, readdata
+    DataList = readdata(readfile('network').strip('\n'))
+    return (lambda: makenetwork(DataList)), len(DataList)
+
+
+def makecases():
+    """
+    :return: an array of (case name, setup function, the arguments of the setup function)
+    """
+    Cases = [('loadstastic/moby_dick', setup_loadstastic, ('moby_dick.txt',)),
+             ('loadstastic/les_miserables', setup_loadstastic, ('les_miserables.txt',)),
+             ('merge_list/TestSuite', lambda: setup_merge_list(testsuite()), ()),
+             ('dicttomatrix/TestSuite', lambda: setup_dicttomatrix(testsuite()), ())]
+    for option in TestAllOptions:
+        Cases.append(('testall/TestSuite/' + option, lambda option=option: setup_testall(testsuite(), option, False), ()))
+    Cases.append(('testgroup/TestSuite', lambda: setup_testgroup(testsuite(), 2, False), ()))
+
+    for NumChunk, NumWord in SyntheticScales:
+        name = '/synthetic-%dx%d' % (NumChunk, NumWord)
+        corpus = lambda NumChunk=NumChunk, NumWord=NumWord: synthetic(NumChunk, NumWord)
+        Cases += [('merge_list' + name, lambda corpus=corpus: setup_merge_list(corpus()), ()),
+                  ('dicttomatrix' + name, lambda corpus=corpus: setup_dicttomatrix(corpus()), ()),
+                  ('information' + name, lambda corpus=corpus: setup_information(corpus()), ()),
+                  ('testall' + name + '/TopStdE', lambda corpus=corpus: setup_testall(corpus(), 'TopStdE', False), ()),
+                  ('testall' + name + '/CustomP', lambda corpus=corpus: setup_testall(corpus(), 'CustomP', False), ()),
+                  ('testall-vectorize' + name + '/CustomP',
+                   lambda corpus=corpus: setup_testall(corpus(), 'CustomP', True), ()),
+                  ('testgroup' + name, lambda corpus=corpus: setup_testgroup(corpus(), 4, False), ()),
+                  ('testgroup-vectorize' + name, lambda corpus=corpus: setup_testgroup(corpus(), 4, True), ())]
+
+    for method in ['r', 'fast', 'rdp', 'vw']:
+        Cases.append(('reduceplot/moby_dick/' + method, setup_reduceplot, (method,)))
+    Cases += [('rollingztest/moby_dick', setup_rollingztest, ()),
+              ('greyword/TestSuite', setup_greyword, ()),
+              ('makenetwork/network', setup_makenetwork, ())]
+    return Cases
+
+
+def importtime(module):
+    """
+    import a module in a new interpreter
+
+    :param module: the name of the module
+    :return: a dictionary contain 'seconds' (the time of the import) and
+                'lazy_loaded' (the packages in LazyPackages the import loaded), or 'error' if the import failed
+    """
+    import subprocess
+    code = ('import sys, timeit; start = timeit.default_timer(); import %s; '
+            'print timeit.default_timer() - start; '
+            'print " ".join(sorted(set(name.split(".")[0] for name in sys.modules) & set(%r)))'
+            % (module, LazyPackages))
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=Root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate()
+    if process.returncode != 0:
+        return {'error': error.strip().split('\n')[-1]}
+    seconds, loaded = (output.split('\n') + [''])[:2]
+    return {'seconds': float(seconds), 'lazy_loaded': loaded.split()}
+
+
+def checkimports(repeat=3):
+    """
+    check the import time of the modules against ImportBudgets
+
+    :param repeat: the number of time each module is imported (the best is kept)
+    :return: (Results, Failures)
+                Results: a dictionary map module name to the result of importtime()
+                Failures: an array of the message of each module over budget (or loading scipy / matplotlib)
+    """
+    Results = {}
+    Failures = []
+    for module, budget in sorted(ImportBudgets.items()):
+        Runs = [importtime(module) for i in range(repeat)]
+        Errors = [run for run in Runs if 'error' in run]
+        result = Errors[0] if Errors else min(Runs, key=lambda run: run['seconds'])
+        result['budget'] = budget
+        Results[module] = result
+        if 'error' in result:
+            Failures.append('%s: %s' % (module, result['error']))
+            continue
+        if result['seconds'] > budget:
+            Failures.append('%s: import takes %.3f s (budget %.3f s)' % (module, result['seconds'], budget))
+        if result['lazy_loaded']:
+            Failures.append('%s: import loads %s' % (module, ', '.join(result['lazy_loaded'])))
+    return Results, Failures
+
+
+def runcase(setup, args, repeat, queue):
+    """
+    run a case in the current process (this is the target of the process started by measure())
+    and put the result in the queue
+    """
+    try:
+        function, items = setup(*args)
+        SetupMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        Times = []
+        for i in range(repeat):
+            start = timeit.default_timer()
+            function()
+            Times.append(timeit.default_timer() - start)
+        PeakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put({'seconds': min(Times),
+                   'throughput': items / min(Times) if min(Times) > 0 else None,
+                   'items': items,
+                   'peak_kb': PeakMemory,
+                   'peak_above_setup_kb': PeakMemory - SetupMemory})
+    except Exception as error:
+        queue.put({'error': '%s: %s' % (type(error).__name__, error)})
+
+
+def measure(setup, args, repeat=3):
+    """
+    run a case in a new process
+
+    :return: a dictionary contain 'seconds' (the best wall time), 'throughput' (item per second),
+                'peak_kb' (peak resident memory of the process), 'peak_above_setup_kb' (the part used by the case itself)
+                or 'error' if the case failed
+    """
+    queue = Queue()
+    process = Process(target=runcase, args=(setup, args, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def compare(Results, Baseline, threshold=0.25):
+    """
+    compare the result to the baseline
+
+    :param Results: the 'cases' of a benchmark result
+    :param Baseline: the 'cases' of the baseline
+    :param threshold: the fraction a case can be slower (or larger) than the baseline before it is a regression
+    :return: an array of (case name, measurement name, baseline value, current value)
+    """
+    Regressions = []
+    for name, result in sorted(Results.items()):
+        base = Baseline.get(name)
+        if base is None or 'error' in base or 'error' in result:
+            continue
+        for key in ['seconds', 'peak_above_setup_kb']:
+            if base[key] > 0 and result[key] > base[key] * (1 + threshold):
+                Regressions.append((name, key, base[key], result[key]))
+    return Regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the hot path of MosesLexo')
+    parser.add_argument('--output', default='benchmark.json', help='where to write the result')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='the stored baseline to compare to')
+    parser.add_argument('--save-baseline', action='store_true', help='also save the result as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='the fraction counted as a regression')
+    parser.add_argument('--filter', default='', help='only run the cases whose name contain this')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of time each case runs (the best is kept)')
+    parser.add_argument('--imports-only', action='store_true', help='only check the import time of the modules')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, Root)
+    Imports, ImportFailures = checkimports(args.repeat)
+    for module, result in sorted(Imports.items()):
+        if 'error' in result:
+            print '%-50s error: %s' % ('import/' + module, result['error'])
+        else:
+            print '%-50s %10.4f s (budget %.3f s)' % ('import/' + module, result['seconds'], result['budget'])
+    for failure in ImportFailures:
+        print 'IMPORT BUDGET', failure
+    if args.imports_only:
+        return 1 if ImportFailures else 0
+
+    Results = {}
+    for name, setup, setupargs in makecases():
+        if args.filter not in name:
+            continue
+        Results[name] = measure(setup, setupargs, args.repeat)
+        result = Results[name]
+        if 'error' in result:
+            print '%-50s error: %s' % (name, result['error'])
+        else:
+            print '%-50s %10.4f s %12.0f item/s %10d KB' % (name, result['seconds'], result['throughput'] or 0,
+                                                            result['peak_kb'])
+
+    Report = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+              'machine': platform.platform(), 'cases': Results, 'imports': Imports}
+    with open(args.output, 'w') as file:
+        json.dump(Report, file, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(Report, file, indent=2, sort_keys=True)
+        return 0
+
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as file:
+            Regressions = compare(Results, json.load(file)['cases'], args.threshold)
+        print
+        for name, key, base, current in Regressions:
+            print 'REGRESSION %s %s: %s -> %s' % (name, key, base, current)
+        if Regressions or ImportFailures:
+            return 1
+        print 'no regression against', args.baseline
+    return 1 if ImportFailures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
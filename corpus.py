@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the function to load a whole corpus (a lot of ALREADY SCRUBBED files) into WordLists at once
+"""
+import os
+import mmap
+from glob import glob
+from extra import streamstastic
+from wordmatrix import WordCounts
+from workerpool import runpool
+from countcache import CountCache, hashfile
+
+TokenizerSettings = 'streamstastic: str.split'  # part of the cache key, change this if the tokenizer changes
+
+
+def findfiles(source):
+    """
+    find all the files of a corpus, in a stable order
+
+    :param source: a directory (all the files directly inside it, sorted by name),
+                    a glob pattern (all the matched files, sorted by path),
+                    a file path, or an array of file path (kept in the given order)
+    :return: an array of file path
+    """
+    if not isinstance(source, basestring):
+        return list(source)
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source))
+                if os.path.isfile(os.path.join(source, name))]
+    if os.path.isfile(source):
+        return [source]
+    return sorted(path for path in glob(source) if os.path.isfile(path))
+
+
+def loadfile(path, blocksize=1 << 20):
+    """
+    memory map a file and count all the word in it (see extra.streamstastic())
+
+    :param path: the path of the file
+    :param blocksize: the number of byte tokenize each time
+    :return: the WordList of the file, a dictionary maps word inside that file to its frequency
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return {}  # empty file can not be memory mapped
+        content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return streamstastic(content, blocksize)
+        finally:
+            content.close()
+
+
+def loadfileworker(task):
+    """
+    loadfile() in a worker process of workerpool.runpool()
+    """
+    return loadfile(*task)
+
+
+def loadcorpus(source, workers=None, blocksize=1 << 20, vocabulary=None, cache=None):
+    """
+    load all the files of a corpus into WordLists, the files are counted in a process pool if workers is given
+    the result can be used directly in topword.testall(), extra.Files_Information and greyword
+
+    :param source: the files of the corpus, see findfiles()
+    :param workers: the number of process to count the files in, default is counting in this process
+    :param blocksize: the number of byte tokenize each time
+    :param vocabulary: a wordmatrix.Vocabulary, if this is given, each WordList is a compact WordCounts using it
+    :param cache: a countcache.CountCache (or the directory of one), the files already in the cache are not
+                    tokenized again, the others are added to the cache.
+                    (use vocabulary=cache.vocabulary to get the cached WordCounts without any conversion)
+    :return: (WordLists, FileNames)
+                WordLists: an array contain dictionaries map from word to word count
+                            each dictionary is word count of a particular file
+                FileNames: an parallel array of WordLists, contain file name of the files
+    """
+    Paths = findfiles(source)
+    WordLists = [None] * len(Paths)
+    if cache is not None:
+        if isinstance(cache, basestring):
+            cache = CountCache(cache)
+        Keys = [hashfile(path, TokenizerSettings) for path in Paths]
+        WordLists = [cache.get(key) for key in Keys]
+    Missing = [i for i in range(len(Paths)) if WordLists[i] is None]
+
+    if workers > 1:
+        Counted = runpool(loadfileworker, [(Paths[i], blocksize) for i in Missing], workers)
+    else:
+        Counted = [loadfile(Paths[i], blocksize) for i in Missing]
+    for i, wordlist in zip(Missing, Counted):
+        WordLists[i] = wordlist if cache is None else cache.put(Keys[i], wordlist)
+
+    for i, wordlist in enumerate(WordLists):
+        if isinstance(wordlist, WordCounts):
+            if vocabulary is None:
+                WordLists[i] = wordlist.todict()
+            elif wordlist.vocabulary is not vocabulary:
+                WordLists[i] = WordCounts.fromdict(wordlist.todict(), vocabulary)
+        elif vocabulary is not None:
+            WordLists[i] = WordCounts.fromdict(wordlist, vocabulary)
+    FileNames = [os.path.basename(path) for path in Paths]
+    return WordLists, FileNames
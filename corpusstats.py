@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the incremental version of topword.testall(), for the case that the user add or drop a chunk and rerun:
+the merged word counts (see extra.merge_list()), the total word count and the statistics needed by the options
+are updated with the chunk that changed, instead of recomputed from all the chunks,
+and the z-test are only redone when their pooled proportion (or the band of word to analyze) changed.
+
+the limit of this: the pooled proportion of every word depends on the total word count, so adding or removing
+a chunk (or an update that changes the size of the chunk) makes CorpusStats.testall() test all the chunks again,
+only the statistics and the bound are saved then. the z-test are only saved for the updates that keep the total
+word count, and for calling testall() again with nothing changed.
+"""
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import numpy as np
+from topword import resolvebound, ztestarray
+
+
+class CorpusStats(object):
+    def __init__(self, WordLists=()):
+        """
+        :param WordLists: the chunks to start with, an array contain dictionaries map from word to word count
+        """
+        self.Chunks = OrderedDict()  # map chunk id to the WordList of the chunk, in the order they are added
+        self.ChunkTotals = {}  # map chunk id to the total word count of the chunk
+        self.MergeList = {}  # map word to its word count in all the chunks
+        self.TotalWordCount = 0
+        self.SumSquare = 0  # sum of (word count) ^ 2 of all the words, for the StdE options
+        self.CountFrequency = {}  # map a word count to the number of words with this word count, for the IQR options
+        self.SortedCounts = []  # all the different word counts, sorted
+        self.NextId = 0
+
+        self.Results = {}  # map chunk id to a dictionary map word to p_value (the result of the last testall())
+        self.SortedResults = {}  # map chunk id to the sorted (word, p_value) list of the chunk
+        self.ResultKey = None  # (Low, High, TotalWordCount) used by the last testall()
+        self.Dirty = set()  # the chunks that need to be tested again completely
+        self.ChangedWords = set()  # the words whose merged word count changed since the last testall()
+
+        for wordlist in WordLists:
+            self.add(wordlist)
+
+    def changecount(self, word, change):
+        """
+        change the merged word count of a word, and keep all the statistics up to date
+        """
+        if change == 0:
+            return  # a word with count 0 in a chunk changes nothing (and may not be in self.MergeList)
+        old = self.MergeList.get(word, 0)
+        new = old + change
+        for count, step in ((old, -1), (new, 1)):
+            if count > 0:
+                frequency = self.CountFrequency.get(count, 0) + step
+                if frequency == 0:
+                    del self.CountFrequency[count]
+                    del self.SortedCounts[bisect_left(self.SortedCounts, count)]
+                else:
+                    if frequency == 1 and step == 1:
+                        insort(self.SortedCounts, count)
+                    self.CountFrequency[count] = frequency
+        if new > 0:
+            self.MergeList[word] = new
+        else:
+            del self.MergeList[word]
+        self.TotalWordCount += change
+        self.SumSquare += new * new - old * old
+        self.ChangedWords.add(word)
+
+    def add(self, wordlist):
+        """
+        add a chunk
+
+        :param wordlist: a dictionary map word to word count of the chunk
+        :return: the id of the chunk (used by remove() and update())
+        """
+        id = self.NextId
+        self.NextId += 1
+        self.Chunks[id] = wordlist
+        self.ChunkTotals[id] = sum(wordlist.values())
+        for word, count in wordlist.items():
+            self.changecount(word, count)
+        self.Dirty.add(id)
+        return id
+
+    def remove(self, id):
+        """
+        remove a chunk
+
+        :param id: the id given by add()
+        :return: the WordList of the chunk removed
+        """
+        wordlist = self.Chunks.pop(id)
+        del self.ChunkTotals[id]
+        for word, count in wordlist.items():
+            self.changecount(word, -count)
+        self.Results.pop(id, None)
+        self.SortedResults.pop(id, None)
+        self.Dirty.discard(id)
+        return wordlist
+
+    def update(self, id, wordlist):
+        """
+        replace a chunk with a new WordList (the chunk keeps its place)
+
+        :param id: the id given by add()
+        :param wordlist: the new dictionary map word to word count of the chunk
+        """
+        old = self.Chunks[id]
+        for word in set(old.keys()) | set(wordlist.keys()):
+            change = wordlist.get(word, 0) - old.get(word, 0)
+            if change != 0:
+                self.changecount(word, change)
+        self.Chunks[id] = wordlist
+        self.ChunkTotals[id] = sum(wordlist.values())
+        self.Dirty.add(id)
+
+    def quantile(self, position):
+        """
+        :return: the word count at the position if all the merged word counts are sorted
+        """
+        for count in self.SortedCounts:
+            position -= self.CountFrequency[count]
+            if position < 0:
+                return count
+        raise IndexError(position)
+
+    def bound(self, option='CustomP', Low=0.0, High=1.0):
+        """
+        resolve the option of testall() into the actual Low and High (see topword.testall())
+
+        :return: (Low, High)
+        """
+        NumWord = len(self.MergeList)
+        return resolvebound(option, Low, High, self.TotalWordCount, NumWord,
+                            lambda: self.SumSquare - self.TotalWordCount ** 2 / NumWord, self.quantile)
+
+    def testwords(self, id, words):
+        """
+        do the z-test of the words in a chunk, update self.Results
+
+        :param id: the chunk id
+        :param words: the words to test (all in the chunk)
+        """
+        Low, High, TotalWordCount = self.ResultKey
+        wordlist = self.Chunks[id]
+        Result = self.Results[id]
+        Tested = []
+        for word in words:
+            if Low < self.MergeList.get(word, 0) / TotalWordCount < High:
+                Tested.append(word)
+            else:
+                Result.pop(word, None)
+        if Tested:
+            ListWordCount = self.ChunkTotals[id]
+            p_values = ztestarray(np.array([wordlist[word] for word in Tested]) / ListWordCount,
+                                  np.array([self.MergeList[word] for word in Tested]) / TotalWordCount,
+                                  ListWordCount, TotalWordCount)
+            for word, p_value in zip(Tested, p_values.tolist()):
+                Result[word] = 'Insignificant' if p_value != p_value else p_value
+
+    def testall(self, option='CustomP', Low=0.0, High=1.0):
+        """
+        the same p_values as topword.testall() on all the chunks
+        (see topword.testall() for the parameters and the return), but the words with the same p_value
+        can be in a different order in each sorted list.
+        only the z-test that could have changed since the last call are done again:
+            if the total word count or the band (Low, High) changed, every pooled proportion changed,
+            so all the chunks are tested again;
+            otherwise only the chunks added or updated, and the words whose merged count changed are tested again
+        """
+        Low, High = self.bound(option, Low, High)
+        Key = (Low, High, self.TotalWordCount)
+        if Key != self.ResultKey:
+            self.ResultKey = Key
+            self.Dirty = set(self.Chunks)
+
+        for id, wordlist in self.Chunks.items():
+            if id in self.Dirty:
+                self.Results[id] = {}
+                self.testwords(id, wordlist.keys())
+            elif self.ChangedWords:
+                if len(self.ChangedWords) < len(wordlist):
+                    words = [word for word in self.ChangedWords if word in wordlist]
+                else:
+                    words = [word for word in wordlist if word in self.ChangedWords]
+                if not words:
+                    continue
+                self.testwords(id, words)
+            else:
+                continue
+            self.SortedResults[id] = sorted(self.Results[id].items(), key=lambda item: item[1])
+
+        self.Dirty = set()
+        self.ChangedWords = set()
+        return [self.SortedResults[id] for id in self.Chunks]
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the on disk cache of the word counts of files, so that a file is only tokenized once
+each entry is keyed by the hash of the file content and the tokenizer settings,
+and stored as an .npz file of the words and their counts. each entry has its own words (nothing is shared
+between the entries), so several caches (several processes) can use one directory at the same time.
+the cache has a size bound, the entries used least recently are removed first, a broken entry is removed when read.
+(the sizes are read when the cache is opened, then kept up to date by this object,
+so the entries another process adds later are only counted by the caches opened after)
+
+the cache directory looks like:
+    <key>.npz           the 'words' (a byte array, the words joined by newline) and 'counts' array of a file
+"""
+import os
+import hashlib
+import tempfile
+from zipfile import BadZipfile, is_zipfile
+from collections import OrderedDict
+import numpy as np
+from wordmatrix import Vocabulary, WordCounts
+
+
+def hashfile(path, settings='', blocksize=1 << 20):
+    """
+    :param path: the path of the file
+    :param settings: a string describing the tokenizer settings, it is part of the key
+    :return: the cache key of the file (a hex string)
+    """
+    digest = hashlib.sha1(settings + '\0')
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(blocksize)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CountCache(object):
+    def __init__(self, directory, maxbytes=1 << 30):
+        """
+        open (or create) a cache directory
+
+        :param directory: the directory of the cache
+        :param maxbytes: the largest total size of the entries
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.vocabulary = Vocabulary()  # the vocabulary of the WordCounts given by get() and put()
+
+        # map entry file name to its size, the least recently used first
+        Entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(directory, name))
+                Entries.append((stat.st_mtime, name, stat.st_size))
+        self.Sizes = OrderedDict((name, size) for time, name, size in sorted(Entries))
+        self.Total = sum(self.Sizes.values())  # the total size of the entries
+        self.evict()  # the cache may be opened with a smaller maxbytes than before
+
+    def entrypath(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """
+        :param key: the key of the file (see hashfile())
+        :return: the WordCounts of the file (using self.vocabulary), None if it is not in the cache
+        """
+        path = self.entrypath(key)
+        try:
+            with open(path, 'rb') as file:
+                if not is_zipfile(file):  # checked first, np.load() complains on stderr about a broken .npz
+                    raise BadZipfile(path)
+                file.seek(0)
+                entry = np.load(file)
+                words = entry['words'].tostring()
+                counts = entry['counts']
+        except IOError:
+            return None  # not in the cache
+        except (ValueError, KeyError, BadZipfile):
+            self.drop(key + '.npz')  # a broken entry (or one in an old format)
+            return None
+        words = words.split('\n') if words else []
+        if len(words) != len(counts):
+            self.drop(key + '.npz')
+            return None
+        os.utime(path, None)  # mark as recently used
+        self.used(key + '.npz', os.path.getsize(path))
+        return WordCounts(self.vocabulary, self.vocabulary.addall(words), counts)
+
+    def put(self, key, wordlist):
+        """
+        store the word counts of a file
+
+        :param key: the key of the file (see hashfile())
+        :param wordlist: a dictionary map word to word count (or WordCounts using self.vocabulary)
+        :return: the WordCounts stored
+        """
+        if not (isinstance(wordlist, WordCounts) and wordlist.vocabulary is self.vocabulary):
+            wordlist = WordCounts.fromdict(dict(wordlist.items()), self.vocabulary)
+        words = '\n'.join(self.vocabulary.words[id] for id in wordlist.ids.tolist())
+
+        # write to a temporary file first, so that a half written entry is never read
+        # (the name is unique, so two processes putting the same entry do not write into the same file)
+        path = self.entrypath(key)
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, words=np.frombuffer(words, dtype=np.uint8), counts=wordlist.counts)
+        os.rename(temporary, path)
+        self.used(key + '.npz', os.path.getsize(path))
+        self.evict()
+        return wordlist
+
+    def used(self, name, size):
+        """
+        mark an entry as the most recently used, and update its size
+        """
+        self.Total += size - self.Sizes.pop(name, 0)
+        self.Sizes[name] = size
+
+    def drop(self, name):
+        """
+        remove an entry file
+        """
+        self.Total -= self.Sizes.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass  # already removed by another cache on the same directory
+
+    def evict(self):
+        """
+        remove the least recently used entries until the total size is within self.maxbytes
+        """
+        while self.Total > self.maxbytes and self.Sizes:
+            self.drop(next(iter(self.Sizes)))
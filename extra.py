@@ -1,61 +1,72 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
-from scipy.spatial.distance import pdist
-from scipy.cluster import hierarchy
 
 """
 this are some utility function to help do the analysis not only in topword.py
+scipy and matplotlib are slow to import, so they are only imported by the functions using them
+(the plots and the dendrogram), loading the word counts only needs numpy
 """
 from math import sqrt
-from operator import itemgetter
-from matplotlib import mlab
-import matplotlib.pyplot as plt
+from collections import Counter
+import sys
+import numpy as np
+from wordmatrix import DocumentTermMatrix, WordCounts
+from instrument import stage
+
+
+def describe(Counts):
+    """
+    the statistics of an array of counts, all computed with numpy (the quartiles are selected, not sorted)
+
+    :param Counts: a numpy array of counts (word counts of a file, or the sizes of the files)
+    :return: (Average, StdE, Q1, Median, Q3)
+                Q1, Median and Q3 are the elements at position n / 4, n / 2 and n * 3 / 4 if the counts are sorted
+    """
+    NumCount = len(Counts)
+    Average = Counts.sum() / NumCount
+    Deviation = Counts - Average
+    StdE = sqrt(np.dot(Deviation, Deviation) / NumCount)
+    Positions = [int(NumCount / 4), int(NumCount / 2), int(NumCount * 3 / 4)]
+    Q1, Median, Q3 = np.partition(Counts, Positions)[Positions].tolist()
+    return float(Average), StdE, Q1, Median, Q3
+
+
+def anomalies(Names, Counts, Low, High):
+    """
+    :param Names: an parallel array of Counts, the name of each count
+    :param Counts: a numpy array of counts
+    :return: a dictionary map the name of each count above High to 'large', and below Low to 'small'
+    """
+    Anomaly = {}
+    for i in np.flatnonzero((Counts > High) | (Counts < Low)).tolist():
+        Anomaly[Names[i]] = 'large' if Counts[i] > High else 'small'
+    return Anomaly
 
 
 class Files_Information:
     def __init__(self, WordLists, FileNames):
         """
         takes in wordlists and convert that completely to statistic and give anomalies (about file size)
-        :param WordLists: an array contain dictionaries map from word to word count
+        :param WordLists: an array contain dictionaries map from word to word count (or a DocumentTermMatrix)
                             each dictionary is word count of a particular file
         :param FileNames: an parallel array of WordLists, contain file name of the files(in order to plot)
         """
 
         # initialize
         NumFile = len(WordLists)
-        FileAnomalyStdE = {}
-        FileAnomalyIQR = {}
-        FileSizes = {}
-        for i in range(NumFile):
-            FileSizes.update({FileNames[i]: sum(WordLists[i].values())})
+        if isinstance(WordLists, DocumentTermMatrix):
+            Sizes = WordLists.totals()
+        else:
+            Sizes = np.array([sum(wordlist.values()) for wordlist in WordLists])
+        FileSizes = dict(zip(FileNames, Sizes.tolist()))
+        Average_FileSize, StdE_FileSize, Q1, Mid, Q3 = describe(Sizes)
+        IQR = Q3 - Q1
 
         # 1 standard error analysis
-        Average_FileSize = sum(FileSizes.values()) / NumFile
-        # calculate the StdE
-        StdE_FileSize = 0
-        for filesize in FileSizes.values():
-            StdE_FileSize += (filesize - Average_FileSize) ** 2
-        StdE_FileSize /= NumFile
-        StdE_FileSize = sqrt(StdE_FileSize)
-        # calculate the anomaly
-        for filename in FileNames:
-            if FileSizes[filename] > Average_FileSize + 2 * StdE_FileSize:
-                FileAnomalyStdE.update({filename: 'large'})
-            elif FileSizes[filename] < Average_FileSize - 2 * StdE_FileSize:
-                FileAnomalyStdE.update({filename: 'small'})
-
+        FileAnomalyStdE = anomalies(FileNames, Sizes, Average_FileSize - 2 * StdE_FileSize,
+                                    Average_FileSize + 2 * StdE_FileSize)
         # 2 IQR analysis
-        TempList = sorted(FileSizes.items(), key=itemgetter(1))
-        Mid = TempList[int(NumFile / 2)][1]
-        Q3 = TempList[int(NumFile * 3 / 4)][1]
-        Q1 = TempList[int(NumFile / 4)][1]
-        IQR = Q3 - Q1
-        # calculate the anomaly
-        for filename in FileNames:
-            if FileSizes[filename] > Mid + 1.5 * IQR:
-                FileAnomalyIQR.update({filename: 'large'})
-            elif FileSizes[filename] < Mid - 1.5 * IQR:
-                FileAnomalyIQR.update({filename: 'small'})
+        FileAnomalyIQR = anomalies(FileNames, Sizes, Mid - 1.5 * IQR, Mid + 1.5 * IQR)
 
         # pack the data
         self.NumFile = NumFile  # number of files
@@ -91,6 +102,7 @@ class Files_Information:
         x is the file name
         y is the file size(using word count to represent)
         """
+        import matplotlib.pyplot as plt
         plt.bar(range(self.NumFile), self.FileSizes.values(), align='center')
         plt.xticks(range(self.NumFile), self.FileSizes.keys())
         plt.xticks(rotation=50)
@@ -111,32 +123,27 @@ class Files_Information:
                 'IQR': self.IQR,
                 'fileanomalyIQR': self.FileAnomalyIQR}
 
+    returnstatistics = returnstatistcs  # the same name as Word_Information.returnstatistics()
+
 
 class Word_Information:
     def __init__(self, WordList, FileName):
         """
         takes a WordList of a file and the file name of that file to give statistics of that particular file
         :param WordList: an dictionary map word to word count representing the word count of particular file
+                            (or a WordCounts)
         :param FileName: the file name of that file
         """
 
         # initialize
         NumWord = len(WordList)
-        TotalWordCount = sum(WordList.values())
-        # 1 standard error analysis
-        AverageWordCount = TotalWordCount / NumWord
-        # calculate the StdE
-        StdEWordCount = 0
-        for WordCount in WordList.values():
-            StdEWordCount += (WordCount - AverageWordCount) ** 2
-        StdEWordCount /= NumWord
-        StdEWordCount = sqrt(StdEWordCount)
-
-        # 2 IQR analysis
-        TempList = sorted(WordList.items(), key=itemgetter(1))
-        Mid = TempList[int(NumWord / 2)][1]
-        Q3 = TempList[int(NumWord * 3 / 4)][1]
-        Q1 = TempList[int(NumWord / 4)][1]
+        if isinstance(WordList, WordCounts):
+            Counts = WordList.counts.astype(np.int64)  # the counts are stored as uint32
+        else:
+            Counts = np.array(WordList.values())
+        TotalWordCount = Counts.sum().item()
+        # 1 standard error analysis and 2 IQR analysis
+        AverageWordCount, StdEWordCount, Q1, Mid, Q3 = describe(Counts)
         IQR = Q3 - Q1
 
         # pack the data
@@ -174,6 +181,8 @@ class Word_Information:
         :param num_bins: number of bars, default is (Number different word in the file )/ 2,
                             if it is too large take 50 as default (see '#default of num_bins')
         """
+        from matplotlib import mlab
+        import matplotlib.pyplot as plt
         # plot data
         mu = self.Average  # mean of distribution
         sigma = self.StdE  # standard deviation of distribution
@@ -194,10 +203,16 @@ class Word_Information:
 
     def returnstatistics(self):
         """
-        you are on your own pal. Mimic FileInformation.retrunstatistics().
-
+        :return: a dictionary map the statistic name to the actual statistics
         """
-        pass
+        return {'numword': self.NumWord,
+                'totalwordcount': self.TotalWordCount,
+                'average': self.Average,
+                'StdE': self.StdE,
+                'median': self.Median,
+                'Q1': self.Q1,
+                'Q3': self.Q3,
+                'IQR': self.IQR}
 
 
 def merge_list(wordlists):
@@ -206,45 +221,136 @@ def merge_list(wordlists):
 
     :param wordlists: an array contain all the wordlist(dictionary type)
     :return: the merged word list (dictionary type)
+                (if all the wordlist are WordCounts with the same Vocabulary, this is a WordCounts as well)
     """
-    mergelist = {}
-    for wordlist in wordlists:
-        for key in wordlist.keys():
-            try:
-                mergelist[key] += wordlist[key]
-            except:
-                mergelist.update({key: wordlist[key]})
-    return mergelist
-
-
-def loadstastic(file):
+    with stage('merge_list'):
+        if wordlists and all(isinstance(wordlist, WordCounts) and wordlist.vocabulary is wordlists[0].vocabulary
+                             for wordlist in wordlists):
+            return WordCounts.merge(wordlists)
+
+        mergelist = {}
+        for wordlist in wordlists:
+            for key in wordlist.keys():
+                try:
+                    mergelist[key] += wordlist[key]
+                except:
+                    mergelist.update({key: wordlist[key]})
+        return mergelist
+
+
+def loadstastic(file, vocabulary=None):
     """
     this method takes an ALREADY SCRUBBED chunk of file(string), and convert that into a WordLists
     (see :return for this function or see the document for 'test' function, :param WordLists)
 
     :param file: a string contain an AlREADY SCRUBBED file
+    :param vocabulary: a wordmatrix.Vocabulary, if this is given, the result is a compact WordCounts using it
     :return: a WordLists: Array type
             each element of array represent a chunk, and it is a dictionary type
             each element in the dictionary maps word inside that chunk to its frequency
     """
-    Words = file.split()
-    Wordlist = {}
-    for word in Words:
-        try:
-            Wordlist[word] += 1
-        except:
-            Wordlist.update({word: 1})
-    return Wordlist
+    with stage('loadstastic'):
+        Words = file.split()
+        if vocabulary is not None:
+            return WordCounts.fromtokens(Words, vocabulary)
+        Wordlist = {}
+        for word in Words:
+            try:
+                Wordlist[word] += 1
+            except:
+                Wordlist.update({word: 1})
+        return Wordlist
+
 
+def readtokens(source, blocksize=1 << 20):
+    """
+    read the tokens (split by white space, the same as str.split()) of an ALREADY SCRUBBED file block by block,
+    so that the whole file is never in memory.
+    a token that goes across the boundary of two blocks is joint back together.
 
-def matrixtodict(matrix):
+    :param source: a file path, or anything has a read(size) method (file object, mmap...)
+    :param blocksize: the number of byte read each time
+    :return: a generator gives the tokens of each block (each element is an array of token)
+    """
+    if isinstance(source, basestring):
+        with open(source, 'r') as file:
+            for tokens in readtokens(file, blocksize):
+                yield tokens
+        return
+
+    rest = ''  # the part of the token that is cut by the end of the last block
+    while True:
+        block = source.read(blocksize)
+        if not block:
+            break
+        tokens = (rest + block).split()
+        if tokens and not block[-1].isspace():
+            rest = tokens.pop()
+        else:
+            rest = ''
+        yield tokens
+    if rest:
+        yield [rest]
+
+
+def streamstastic(source, blocksize=1 << 20):
+    """
+    the streaming version of loadstastic(), count all the word in a file without loading the whole file
+
+    :param source: a file path, or anything has a read(size) method (file object, mmap...)
+    :param blocksize: the number of byte read each time
+    :return: a WordList, a dictionary maps word inside that file to its frequency
+    """
+    with stage('streamstastic'):
+        Wordlist = Counter()
+        for tokens in readtokens(source, blocksize):
+            Wordlist.update(tokens)
+        return dict(Wordlist)
+
+
+def streamchunks(source, chunksize, blocksize=1 << 20):
+    """
+    cut a file into chunks of chunksize words and count each chunk, without loading the whole file
+
+    :param source: a file path, or anything has a read(size) method (file object, mmap...)
+    :param chunksize: the number of word in each chunk (the last chunk has all the word left, could be less)
+    :param blocksize: the number of byte read each time
+    :return: a generator gives the WordList of each chunk (see loadstastic())
+    """
+    if chunksize <= 0:  # no word would ever be taken, the loop below would never end
+        print('input error')
+        exit(-1)
+    Wordlist = Counter()
+    NumWord = 0  # number of word in Wordlist
+    for tokens in readtokens(source, blocksize):
+        start = 0
+        while len(tokens) - start >= chunksize - NumWord:
+            end = start + chunksize - NumWord
+            Wordlist.update(tokens[start:end])
+            yield dict(Wordlist)
+            Wordlist = Counter()
+            NumWord = 0
+            start = end
+        Wordlist.update(tokens[start:])
+        NumWord += len(tokens) - start
+    if NumWord:
+        yield dict(Wordlist)
+
+
+def matrixtodict(matrix, Words=None):
     """
     convert a word matrix(which is generated in getMatirx() method in ModelClass.py) to
     the one that is used in the test() method in this file.
 
     :param matrix: the count matrix generated by getMatrix method
+                    or a scipy sparse matrix / numpy array generated by dicttomatrix() (then Words is needed)
+    :param Words: the word of each column of a sparse matrix / numpy array
+                    (for those, only the non-zero counts are put into the dictionaries,
+                    and the time needed is proportional to the number of non-zero counts)
     :return: a Result Array(each element is a dict) that test method can use
     """
+    if Words is not None:
+        return DocumentTermMatrix(matrix, Words).todicts()
 
     ResultArray = []
     for i in range(1, len(matrix)):
@@ -255,7 +361,22 @@ def matrixtodict(matrix):
     return ResultArray
 
 
-def dicttomatrix(WordLists):
+def dicttomatrix(WordLists, form='list'):
+    """
+    convert WordLists into a count matrix
+
+    :param WordLists: an array contain dictionaries map from word to word count (or WordCounts)
+    :param form: 'list': the matrix is a list of rows, each row is a list of counts
+                 'sparse': the matrix is a scipy CSR matrix, the time needed is proportional to the number of
+                            non-zero counts (not number of chunks * number of words)
+                 'dense': the matrix is a numpy array
+    :return: (the matrix, the word of each column)
+                each row of the matrix is a chunk, each column is a word
+    """
+    if form != 'list':
+        Matrix = DocumentTermMatrix.load(WordLists)
+        return (Matrix.counts if form == 'sparse' else Matrix.counts.toarray()), Matrix.words
+
     # convert into matrix
     Totallist = merge_list(WordLists)
     Matrix = []
@@ -274,5 +395,102 @@ def dicttomatrix(WordLists):
     return Matrix, Words
 
 
+def blockpdist(Matrix, metric='euclidean', blocksize=1024):
+    """
+    the condensed distance matrix (the same as scipy's pdist()) of the rows of a sparse matrix,
+    computed a block of rows at a time, so the dense matrix (chunks * vocabulary) is never made
+
+    :param Matrix: a CSR matrix, each row is a point
+    :param metric: 'euclidean', 'sqeuclidean' or 'cosine'
+    :param blocksize: the number of row computed at a time (memory used is about blocksize * number of row)
+    :return: the condensed distance matrix (an array of n * (n - 1) / 2 distances)
+    """
+    n = Matrix.shape[0]
+    Norms = np.asarray(Matrix.multiply(Matrix).sum(axis=1)).ravel()
+    Distances = np.empty(n * (n - 1) // 2)
+    for start in range(0, n, blocksize):
+        end = min(start + blocksize, n)
+        Block = np.asarray(Matrix[start:end].dot(Matrix[start:].T).todense())  # the dot products with later rows
+        if metric == 'cosine':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                Block = 1 - Block / np.sqrt(np.outer(Norms[start:end], Norms[start:]))
+        else:
+            Block = np.maximum(Norms[start:end, None] + Norms[None, start:] - 2 * Block, 0)
+            if metric == 'euclidean':
+                Block = np.sqrt(Block)
+        for i in range(start, end):
+            first = n * i - i * (i + 1) // 2  # the place of (i, i + 1) in the condensed matrix
+            Distances[first:first + n - i - 1] = Block[i - start, i - start + 1:]
+    return Distances
+
+
+def treeheight(Linkage):
+    """
+    :param Linkage: a linkage matrix (see scipy's linkage())
+    :return: the number of levels of the tree (a single chunk is 0)
+    """
+    n = len(Linkage) + 1
+    Heights = [0] * (2 * n - 1)
+    for i, row in enumerate(Linkage[:, :2].astype(int).tolist()):
+        Heights[n + i] = 1 + max(Heights[row[0]], Heights[row[1]])
+    return Heights[-1]
+
+
+def creatdendro(WordLists, ChunkSizes=None, metric='euclidean', method='average', labels=None, blocked=None,
+                blocksize=1024, plotinfo=True):
+    """
+    cluster the chunks and make the dendrogram of them
+    each chunk is represented by the proportion of each word in it (word count / chunk size)
+
+    :param WordLists: an array contain dictionaries map from word to word count (or a DocumentTermMatrix)
+                        each dictionary is word count of a particular chunk
+    :param ChunkSizes: an parallel array of WordLists, contain the size of each chunk (default is the total word count)
+    :param metric: the distance between two chunks, any metric of scipy's pdist()
+                    ('euclidean', 'cityblock', 'cosine', 'correlation'...)
+    :param method: the linkage method of scipy's linkage() ('average', 'single', 'complete', 'weighted', 'ward'...)
+    :param labels: an parallel array of WordLists, the label of each chunk in the dendrogram
+    :param blocked: compute the distance from the sparse matrix a block at a time (see blockpdist()),
+                    only 'euclidean', 'sqeuclidean' and 'cosine' can be blocked.
+                    default is blocked if the dense matrix would be larger than 100 million cells
+    :param blocksize: see blockpdist()
+    :param plotinfo: also give the coordinates to draw the dendrogram (see scipy's dendrogram())
+                        if this is False, the result only has 'leaves' and 'linkage'
+                        (scipy's dendrogram() is recursive, one level per level of the tree, so the coordinates
+                        are not given either if the tree is deeper than half the recursion limit)
+    :return: a dictionary: 'leaves': the chunk number of each leaf, from left to right
+                            'linkage': the linkage matrix
+                            and the other result of scipy's dendrogram() if plotinfo is True
+    """
+    from scipy.spatial.distance import pdist
+    from scipy.cluster import hierarchy
+    Matrix = DocumentTermMatrix.load(WordLists)
+    Counts = Matrix.counts.astype(float)
+    n = len(Matrix)
+    if ChunkSizes is None:
+        ChunkSizes = Matrix.totals()
+    if n < 2:
+        return {'leaves': range(n), 'linkage': np.zeros((0, 4))}
+
+    # use the proportion of each word
+    Sizes = np.asarray(ChunkSizes, dtype=float)
+    Sizes[Sizes == 0] = 1
+    Proportions = Counts.multiply(1 / Sizes[:, None]).tocsr()
+
+    if blocked is None:
+        blocked = n * len(Matrix.words) > 10 ** 8 and metric in ('euclidean', 'sqeuclidean', 'cosine')
+    if blocked:
+        Distances = blockpdist(Proportions, metric, blocksize)
+    else:
+        Distances = pdist(Proportions.toarray(), metric)
+
+    Linkage = hierarchy.linkage(Distances, method=method)
+    if not plotinfo or treeheight(Linkage) > sys.getrecursionlimit() // 2:
+        return {'leaves': hierarchy.leaves_list(Linkage).tolist(), 'linkage': Linkage}
+
+    Dendrogram = hierarchy.dendrogram(Linkage, no_plot=True, labels=labels)
+    Dendrogram['linkage'] = Linkage
+    return Dendrogram
+
+
 if __name__ == "__main__":
     print dicttomatrix([{'la': 2, 'he': 10}, {'he': 3}, {'la': 3, 'he': 2}, {'lalala': 3, 'la': 2, 'he': 10}])
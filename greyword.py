@@ -1,45 +1,79 @@
 # -*- coding:utf-8 -*-
 from __future__ import division
 from extra import loadstastic, creatdendro
-from copy import deepcopy
+from corpus import loadcorpus
+from wordmatrix import DocumentTermMatrix
+from instrument import stage
+import numpy as np
 from numpy.random import choice
 from collections import defaultdict
 import operator
 import os
 
 
+def greywordlists(WordLists, matrix=False, blocksize=256):
+    """
+    normalize the size of the chunks by adding grey word:
+    each chunk i gets (Max - size of chunk i) grey words, taken evenly from all the other chunks
+    in proportion to their word usage, so chunk i gets count of word in chunk j * (Max - size_i) / (n - 1) / size_j
+    from each other chunk j (Max is the size of the largest chunk).
+    this is done with one matrix product: Result = Counts + Weights * Counts,
+    where Weights[i][j] = (Max - size_i) / (n - 1) / size_j (0 when i == j)
+
+    :param WordLists: an array contain dictionaries map from word to word count
+                        each dictionary is word count of a particular chunk
+    :param matrix: return the dense result matrix (and the word of each column) instead of the WordLists
+    :param blocksize: the number of chunks converted back to dictionary at a time
+                        (only this many dense rows are in memory at once)
+    :return: the normalized WordLists (an array of dictionaries map word to the new word count),
+                or (the normalized matrix, the word of each column) if matrix is True
+    """
+    Matrix = DocumentTermMatrix.fromwordlists(WordLists)
+    Counts = Matrix.counts.astype(float)
+    Len = len(WordLists)
+    ChunkSizes = Matrix.totals().astype(float)
+    Max = ChunkSizes.max() if Len else 0
+
+    # the grey word weights
+    NumGreyWord = (Max - ChunkSizes) / (Len - 1) if Len > 1 else np.zeros(Len)  # not use itself
+    InverseSizes = np.zeros(Len)
+    InverseSizes[ChunkSizes > 0] = 1 / ChunkSizes[ChunkSizes > 0]
+    Weights = np.outer(NumGreyWord, InverseSizes)
+    np.fill_diagonal(Weights, 0)
+
+    if matrix:
+        return Counts.toarray() + Counts.T.dot(Weights.T).T, Matrix.words
+
+    Result = []
+    Words = np.array(Matrix.words, dtype=object)
+    for start in range(0, Len, blocksize):
+        Block = Counts[start:start + blocksize].toarray() + Counts.T.dot(Weights[start:start + blocksize].T).T
+        for row in Block:
+            columns = np.nonzero(row)[0]
+            Result.append(dict(zip(Words[columns], row[columns].tolist())))
+    return Result
+
+
 def greyword(Contents):
     # load statics
-    Len = len(Contents)
-    WordLists = []
-    ChunkSizes = []
-    for DendroContent in Contents:
-        wordlist = loadstastic(DendroContent)
-        WordLists.append(wordlist)
-        ChunkSizes.append(sum(wordlist.values()))
-    Result = deepcopy(WordLists)
-
-    # find largest file
-    Max = 0
-    for size in ChunkSizes:
-        if Max < size:
-            Max = size
+    WordLists = [loadstastic(DendroContent) for DendroContent in Contents]
+    return greywordcorpus(WordLists)
+
+
+def greywordcorpus(WordLists):
+    """
+    greyword() on chunks already counted (e.g. by corpus.loadcorpus())
+
+    :param WordLists: an array contain dictionaries map from word to word count
+    :return: (the normalized WordLists (see greywordlists()), the chunk number of each leaf of the dendrogram)
+    """
+    ChunkSizes = [sum(wordlist.values()) for wordlist in WordLists]
 
     # create geryword and dendrogram
-    for i in range(Len):  # focus on a file to normalize
-        Diff = Max - ChunkSizes[i]
-        NumGreyWord = Diff / (Len-1)  # not use itself
-
-        for j in range(Len):  # choose a file to pick grey word
-            if j != i and NumGreyWord != 0:  # not it self, or do not need to add
-                for word in WordLists[j].keys():
-                    # add word to the chunk
-                    try:
-                        Result[i][word] += WordLists[j][word]*(NumGreyWord/ChunkSizes[j])
-                    except KeyError:
-                        Result[i].update({word: WordLists[j][word]*(NumGreyWord/ChunkSizes[j])})
-
-    dendro = creatdendro(WordLists, ChunkSizes)['leaves']
+    with stage('greyword/greywordlists'):
+        Result = greywordlists(WordLists)
+    with stage('greyword/dendrogram'):
+        dendro = creatdendro(WordLists, ChunkSizes)['leaves']
     return Result, dendro
 
 
@@ -47,14 +81,9 @@ if __name__ == "__main__":
 
     print 'hello'
     # read from 'TestSuite' folder
-    path = os.path.join(os.getcwd(), 'TestSuite')
-    data = {}
-    for dir_entry in os.listdir(path):
-        dir_entry_path = os.path.join(path, dir_entry)
-        if os.path.isfile(dir_entry_path):
-            with open(dir_entry_path, 'r') as my_file:
-                data[dir_entry] = my_file.read()
-    Content = data.values()
+    WordLists, FileNames = loadcorpus(os.path.join(os.getcwd(), 'TestSuite'))
+    Result, dendro = greywordcorpus(WordLists)
+    print [FileNames[leaf] for leaf in dendro]
 
 
 
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the instrumentation of the analysis pipeline: the time spent in each stage (tokenizing, merging,
+the option bound, the z-test, the sort...), the counters of the hot path (z-test done, words filtered by the
+Low/High band, 'Insignificant' results) and the peak memory.
+
+nothing is recorded unless a recording is started, stage() then gives a shared do-nothing context manager and
+count() returns at once, so the instrumented code costs almost nothing when it is not used.
+(only the current process is recorded, the work done in the worker processes of workerpool.runpool()
+is counted in the stage around runpool(), but their counters are not)
+
+usage:
+    import instrument
+    with instrument.recording(profile=True) as recorder:
+        testall(WordLists, option='TopStdE')
+    recorder.dump('stages.json')            the stages and counters as JSON (see Recording.report())
+    recorder.dumpstats('testall.prof')      the cProfile stats (can be read with pstats or snakeviz)
+
+in the code to instrument:
+    with stage('testall/ztest'):
+        ...
+    count('ztest', len(Tested))
+"""
+import json
+import resource
+import timeit
+from contextlib import contextmanager
+
+Recorder = None  # the current Recording, None if nothing is recorded
+
+
+class Recording(object):
+    def __init__(self, profile=False):
+        """
+        :param profile: also run cProfile while recording
+        """
+        self.Stages = {}  # map stage name to [number of call, total seconds, peak memory (KB) at the end]
+        self.Counters = {}  # map counter name to its value
+        self.StartMemory = peakmemory()
+        self.Seconds = 0  # the wall time of the whole recording (set by stop())
+        self.Start = timeit.default_timer()
+        self.Profiler = None
+        if profile:
+            import cProfile
+            self.Profiler = cProfile.Profile()
+            self.Profiler.enable()
+
+    def finish(self):
+        if self.Profiler is not None:
+            self.Profiler.disable()
+        self.Seconds = timeit.default_timer() - self.Start
+
+    def report(self):
+        """
+        :return: a dictionary: 'seconds': the wall time of the recording
+                                'start_peak_kb': the peak memory of the process when the recording started
+                                'peak_kb': the peak memory of the process at the end of the recording
+                                'stages': map stage name to a dictionary of
+                                        'calls', 'seconds' (total) and 'peak_kb' (the peak memory after the stage)
+                                'counters': map counter name to its value
+                (a stage nested in another is also counted in the outer one)
+        """
+        return {'seconds': self.Seconds,
+                'start_peak_kb': self.StartMemory,
+                'peak_kb': peakmemory(),
+                'stages': dict((name, {'calls': calls, 'seconds': seconds, 'peak_kb': peak})
+                               for name, (calls, seconds, peak) in self.Stages.items()),
+                'counters': dict(self.Counters)}
+
+    def dump(self, path):
+        """
+        write report() to a JSON file
+        """
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2, sort_keys=True)
+
+    def dumpstats(self, path):
+        """
+        write the cProfile stats to a file (only if the recording started with profile=True)
+        """
+        if self.Profiler is None:
+            raise ValueError('the recording is not profiled, use start(profile=True)')
+        self.Profiler.dump_stats(path)
+
+    def list(self):
+        """
+        print the stages and the counters in a good manner
+        """
+        print
+        for name, (calls, seconds, peak) in sorted(self.Stages.items()):
+            print '%-30s %8d calls %10.4f s %10d KB' % (name, calls, seconds, peak)
+        for name, value in sorted(self.Counters.items()):
+            print '%-30s %8d' % (name, value)
+
+
+class Stage(object):
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        seconds = timeit.default_timer() - self.start
+        try:
+            record = self.recorder.Stages[self.name]
+        except KeyError:
+            record = self.recorder.Stages[self.name] = [0, 0, 0]
+        record[0] += 1
+        record[1] += seconds
+        record[2] = peakmemory()
+        return False
+
+
+class NoStage(object):
+    """
+    the stage given when nothing is recorded, it does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+Nothing = NoStage()
+
+
+def peakmemory():
+    """
+    :return: the peak resident memory of this process (in KB on linux)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def enabled():
+    """
+    :return: whether something is recorded (check this before computing a counter that costs time)
+    """
+    return Recorder is not None
+
+
+def stage(name):
+    """
+    :param name: the name of the stage, 'function/part' (e.g. 'testall/ztest')
+    :return: a context manager that adds the time of the block to the stage
+    """
+    if Recorder is None:
+        return Nothing
+    return Stage(Recorder, name)
+
+
+def count(name, value=1):
+    """
+    add value to a counter
+    """
+    if Recorder is not None:
+        Recorder.Counters[name] = Recorder.Counters.get(name, 0) + value
+
+
+def start(profile=False):
+    """
+    start recording (a recording already started is replaced)
+
+    :param profile: also run cProfile while recording
+    :return: the Recording
+    """
+    global Recorder
+    if Recorder is not None:
+        stop()
+    Recorder = Recording(profile)
+    return Recorder
+
+
+def stop():
+    """
+    stop recording
+
+    :return: the Recording (None if nothing is recorded)
+    """
+    global Recorder
+    recorder, Recorder = Recorder, None
+    if recorder is not None:
+        recorder.finish()
+    return recorder
+
+
+@contextmanager
+def recording(profile=False):
+    """
+    record the block (see start())
+
+    :return: the Recording, it can be reported after the block
+    """
+    recorder = start(profile)
+    try:
+        yield recorder
+    finally:
+        stop()
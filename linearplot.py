@@ -7,7 +7,10 @@ this program is the program to reduce the dots needed to draw in the graph in or
 rolling window
 """
 import timeit
+from heapq import heapify, heappop, heappush
+import numpy as np
 from extra import loadstastic, Word_Information
+from topword import ztestarray
 
 
 def get_r(Data, start=0):
@@ -42,7 +45,7 @@ def get_r(Data, start=0):
         return 0  # the highest possible r.
 
 
-def reduceplot(Datas, start=0, LeastCoDe=0, forcedistant=300):
+def reduceplot(Datas, start=0, LeastCoDe=0, forcedistant=300, method='r', tolerance=1.0):
     """
     this program takes in the original data to plot (only y coordinate,
                                                         assume x will start at :param start, move at the pace of 1)
@@ -62,8 +65,25 @@ def reduceplot(Datas, start=0, LeastCoDe=0, forcedistant=300):
                             (the larger this is, the slower the program will run, the speed increase exponentially in the worst case)
                             (the smaller this is, there will be more point send to D3 to draw)
 
+    :param method: the way to choose the point to plot
+                    'r': the original method, see get_r()
+                    'fast': the same idea as 'r', but r is calculated with squared distance (see reduceplot_fast()),
+                            so that each point takes constant time, and forcedistant does not affect the speed
+                    'rdp': Ramer-Douglas-Peucker, keep the point that is more than tolerance away (vertically)
+                            from the line between the point kept (LeastCoDe and forcedistant are not used)
+                    'vw': Visvalingam-Whyatt, remove the point that forms the smallest triangle with its neighbours,
+                            until all the triangles are larger than tolerance (LeastCoDe and forcedistant are not used)
+    :param tolerance: see method
+
     :return: the point that we actually need to plot (x and y coordinate)
     """
+    if method == 'fast':
+        return reduceplot_fast(Datas, start, LeastCoDe, forcedistant)
+    elif method == 'rdp':
+        return reduceplot_rdp(Datas, start, tolerance)
+    elif method == 'vw':
+        return reduceplot_vw(Datas, start, tolerance)
+
     Result = [(start, Datas[0])]
     PreviousDraw = start
     Len = len(Datas)
@@ -80,6 +100,260 @@ def reduceplot(Datas, start=0, LeastCoDe=0, forcedistant=300):
     return Result
 
 
+def reduceplot_fast(Datas, start=0, LeastCoDe=0, forcedistant=300):
+    """
+    the 'fast' method of reduceplot(), see reduceplot() for the parameters
+    the sums needed by the r of every candidate line are read from prefix sums, so each point takes constant time
+    the r here is - (sum of squared distance to the line) / (sum of squared distance to the average),
+    (get_r() uses the absolute distance, so the same LeastCoDe gives a slightly different result)
+    """
+    Datas = np.asarray(Datas)
+    Len = len(Datas)
+    Ys = Datas.astype(float)
+    # prefix sums of y, y^2 and index * y, the sum of Datas[s:e] is Prefix[e] - Prefix[s]
+    Prefix = np.concatenate(([0.0], np.cumsum(Ys))).tolist()
+    Prefix2 = np.concatenate(([0.0], np.cumsum(Ys * Ys))).tolist()
+    PrefixX = np.concatenate(([0.0], np.cumsum(np.arange(Len) * Ys))).tolist()
+    Ys = Ys.tolist()
+    Values = Datas.tolist()
+
+    Result = [(start, Values[0])]
+    PreviousDraw = 0
+    for i in range(1, Len - 1):
+        End = i + 1  # the line goes from PreviousDraw to End, the point between them are checked
+        m = End - PreviousDraw - 1  # number of point checked
+        Sy = Prefix[End] - Prefix[PreviousDraw + 1]
+        Syy = Prefix2[End] - Prefix2[PreviousDraw + 1]
+        Sxy = PrefixX[End] - PrefixX[PreviousDraw + 1] - PreviousDraw * Sy  # x is counted from PreviousDraw
+        Sx = m * (m + 1) / 2
+        Sxx = m * (m + 1) * (2 * m + 1) / 6
+        y0 = Ys[PreviousDraw]
+        a = (Ys[End] - y0) / (m + 1)
+        SSres = Syy - 2 * y0 * Sy - 2 * a * Sxy + m * y0 * y0 + 2 * a * y0 * Sx + a * a * Sxx
+        SStot = Syy - Sy * Sy / m
+        r2 = - SSres / SStot if SStot > 1e-12 * max(Syy, 1) else 0
+        if r2 < LeastCoDe or i - PreviousDraw > forcedistant - 1:  # find a point need to plot
+            Result.append((start + i, Values[i]))
+            PreviousDraw = i
+
+    if Len > 1:
+        Result.append((start + Len - 1, Values[Len - 1]))
+    return Result
+
+
+def reduceplot_rdp(Datas, start=0, tolerance=1.0):
+    """
+    the 'rdp' (Ramer-Douglas-Peucker) method of reduceplot(), see reduceplot() for the parameters
+    """
+    Datas = np.asarray(Datas)
+    Ys = Datas.astype(float)
+    Len = len(Datas)
+    Keep = np.zeros(Len, dtype=bool)
+    Keep[0] = Keep[-1] = True
+
+    Segments = [(0, Len - 1)]
+    while Segments:
+        first, last = Segments.pop()
+        if last - first < 2:
+            continue
+        Xs = np.arange(first + 1, last)
+        Line = Ys[first] + (Ys[last] - Ys[first]) * (Xs - first) / (last - first)
+        Distance = np.abs(Ys[first + 1:last] - Line)
+        farthest = int(np.argmax(Distance))
+        if Distance[farthest] > tolerance:
+            Keep[first + 1 + farthest] = True
+            Segments.append((first, first + 1 + farthest))
+            Segments.append((first + 1 + farthest, last))
+
+    Indexes = np.nonzero(Keep)[0]
+    return zip((Indexes + start).tolist(), Datas[Indexes].tolist())
+
+
+def reduceplot_vw(Datas, start=0, tolerance=1.0):
+    """
+    the 'vw' (Visvalingam-Whyatt) method of reduceplot(), see reduceplot() for the parameters
+    """
+    Datas = np.asarray(Datas)
+    Ys = Datas.astype(float)
+    # the point on the line of its two neighbours do not change the shape, remove them all at once
+    Flat = np.zeros(len(Datas), dtype=bool)
+    if tolerance > 0:
+        Flat[1:-1] = Ys[2:] - Ys[:-2] == (Ys[1:-1] - Ys[:-2]) * 2
+    Xs = np.nonzero(~Flat)[0].tolist()
+    Ys = Ys[~Flat].tolist()
+    Len = len(Xs)
+    Previous = range(-1, Len - 1)
+    Next = range(1, Len + 1)
+    Removed = [False] * Len
+
+    def area(i):
+        p, n = Previous[i], Next[i]
+        return abs((Xs[i] - Xs[p]) * (Ys[n] - Ys[p]) - (Xs[n] - Xs[p]) * (Ys[i] - Ys[p])) / 2
+
+    Areas = [0.0] * Len
+    Heap = []
+    for i in range(1, Len - 1):
+        Areas[i] = area(i)
+        Heap.append((Areas[i], i))
+    heapify(Heap)
+
+    while Heap:
+        Area, i = heappop(Heap)
+        if Removed[i] or Area != Areas[i]:
+            continue  # this entry is out of date
+        if Area >= tolerance:
+            break
+        Removed[i] = True
+        p, n = Previous[i], Next[i]
+        Next[p], Previous[n] = n, p
+        for neighbour in (p, n):
+            if 0 < neighbour < Len - 1:
+                # the area of a point never goes below the one just removed
+                Areas[neighbour] = max(area(neighbour), Area)
+                heappush(Heap, (Areas[neighbour], neighbour))
+
+    Values = Datas.tolist()
+    return [(start + Xs[i], Values[Xs[i]]) for i in range(Len) if not Removed[i]]
+
+
+def targetwords(target):
+    """
+    :return: the words of a target (a word, or a tuple of words)
+    """
+    return [target] if isinstance(target, basestring) else target
+
+
+def targetids(Tokens, Targets):
+    """
+    :return: (WordIds, Ids)
+                WordIds: a dictionary map each word of the targets to a word number
+                Ids: a numpy array of the word number of each token (-1 if the token is not a target word)
+    """
+    WordIds = {}
+    for target in Targets:
+        for word in targetwords(target):
+            WordIds.setdefault(word, len(WordIds))
+    Ids = np.fromiter((WordIds.get(token, -1) for token in Tokens), dtype=int, count=len(Tokens))
+    return WordIds, Ids
+
+
+def rollingwindow(Tokens, Targets, WindowSizes=101, proportion=False):
+    """
+    this function gives the rolling window data of a list of tokens (the count of the target words in each window)
+    all the targets and window sizes are done in one pass over the tokens,
+    each window is then the difference of two prefix sums, so the time does not depend on the window size
+
+    :param Tokens: the tokens (words) of the text, in order
+    :param Targets: an array of the target to count, each target is either a word,
+                    or a tuple of words (the count of all the words in the tuple are added together)
+    :param WindowSizes: the number of token in a window, or an array of window sizes
+    :param proportion: give the proportion of the target in the window instead of the count
+    :return: a dictionary map (target, window size) to the data to plot (a numpy array, can be passed to reduceplot)
+                the data has (number of tokens - window size + 1) point, point i is the window starts at token i
+    """
+    if isinstance(WindowSizes, int):
+        WindowSizes = [WindowSizes]
+
+    WordIds, Ids = targetids(Tokens, Targets)
+
+    Result = {}
+    for target in Targets:
+        Prefix = np.concatenate(([0], np.cumsum(np.in1d(Ids, [WordIds[word] for word in targetwords(target)]))))
+        for size in WindowSizes:
+            Counts = Prefix[size:] - Prefix[:-size] if size <= len(Tokens) else np.zeros(0, dtype=int)
+            Result[(target, size)] = Counts / size if proportion else Counts
+    return Result
+
+
+def mergewindows(Starts, WindowSize, p_values):
+    """
+    merge the significant windows that overlap (or touch) into intervals
+
+    :param Starts: the sorted start of each significant window
+    :param WindowSize: the number of token in a window
+    :param p_values: the p_value of each significant window
+    :return: an array of (start, end, lowest p_value), the interval is the tokens [start, end)
+    """
+    if len(Starts) == 0:
+        return []
+    Ends = Starts + WindowSize
+    Firsts = np.concatenate(([0], np.flatnonzero(Starts[1:] > Ends[:-1]) + 1))  # the first window of each interval
+    Lasts = np.concatenate((Firsts[1:] - 1, [len(Starts) - 1]))
+    return zip(Starts[Firsts].tolist(), Ends[Lasts].tolist(), np.minimum.reduceat(p_values, Firsts).tolist())
+
+
+def rollingztest(Tokens, Targets, WindowSize=1000, step=1, threshold=0.05, direction='both', blocksize=1 << 22):
+    """
+    this function finds the passages where a target word is used anomalously:
+    every window is compared to the whole text with the z-test (see topword.ztest(), the window is the chunk),
+    and the significant windows next to each other are merged into intervals.
+    the count of each target in each window is the difference of two prefix counts (found by binary search
+    in the positions of the target words), so the time does not depend on the window size,
+    and the z-test is done on a whole block of (target, window) at once.
+
+    :param Tokens: the tokens (words) of the text, in order
+    :param Targets: an array of the target to test, each target is either a word,
+                    or a tuple of words (the count of all the words in the tuple are added together)
+    :param WindowSize: the number of token in a window
+    :param step: the distance (in tokens) between the start of two windows tested
+    :param threshold: a window is significant if its p_value is less than this value
+                        (there are a lot of windows, so this should be much smaller than the usual 0.05)
+    :param direction: 'both': all the significant windows
+                      'over': only the windows using the target more than the whole text
+                      'under': only the windows using the target less than the whole text
+    :param blocksize: the most (target, window) pair tested at once, this bounds the memory used
+                        (the targets and the window positions are both split into blocks)
+    :return: a dictionary map each target to an array of (start, end, lowest p_value), sorted by start
+                each is an interval of tokens [start, end) where the target is anomalous,
+                lowest p_value is the smallest p_value of the windows in the interval
+    """
+    if direction not in ('both', 'over', 'under'):
+        print('input error')
+        exit(-1)
+    NumToken = len(Tokens)
+    WordIds, Ids = targetids(Tokens, Targets)
+    Starts = np.arange(0, NumToken - WindowSize + 1, step)
+
+    # the position of each target word, target i is shifted by i * (NumToken + 1),
+    # so the positions of all the targets are in one sorted array
+    Positions = [np.flatnonzero(np.in1d(Ids, [WordIds[word] for word in targetwords(target)])) for target in Targets]
+    Totals = np.array([len(positions) for positions in Positions])
+    Shifted = np.concatenate([positions + i * (NumToken + 1) for i, positions in enumerate(Positions)] +
+                             [np.zeros(0, dtype=int)])
+
+    # a block is (some targets) x (some window positions), with at most blocksize pairs
+    PositionBlock = max(1, min(len(Starts), blocksize))  # the number of window positions tested at once
+    TargetBlock = max(1, blocksize // PositionBlock)  # the number of target tested at once
+    Result = {}
+    for first in range(0, len(Targets), TargetBlock):
+        Offsets = (np.arange(first, min(first + TargetBlock, len(Targets))) * (NumToken + 1))[:, np.newaxis]
+        TotalProportions = (Totals[first: first + TargetBlock] / NumToken)[:, np.newaxis]
+        SignificantStarts = [[] for offset in Offsets]  # the significant windows of each target, block by block
+        SignificantValues = [[] for offset in Offsets]
+        for start in range(0, len(Starts), PositionBlock):
+            BlockStarts = Starts[start: start + PositionBlock]
+            Counts = np.searchsorted(Shifted, Offsets + BlockStarts + WindowSize) - \
+                np.searchsorted(Shifted, Offsets + BlockStarts)
+            Proportions = Counts / WindowSize
+            p_values = ztestarray(Proportions, TotalProportions, WindowSize, NumToken)
+
+            with np.errstate(invalid='ignore'):  # nan (all the same) is never significant
+                Significant = p_values < threshold
+            if direction == 'over':
+                Significant &= Proportions > TotalProportions
+            elif direction == 'under':
+                Significant &= Proportions < TotalProportions
+            for row in range(len(Offsets)):
+                columns = np.flatnonzero(Significant[row])
+                SignificantStarts[row].append(BlockStarts[columns])
+                SignificantValues[row].append(p_values[row, columns])
+        for row in range(len(Offsets)):
+            Result[Targets[first + row]] = mergewindows(np.concatenate([Starts[:0]] + SignificantStarts[row]),
+                                                        WindowSize,
+                                                        np.concatenate([np.zeros(0)] + SignificantValues[row]))
+    return Result
+
+
 if __name__ == '__main__':
 
     FileName = 'moby_dick.txt'
@@ -90,11 +364,7 @@ if __name__ == '__main__':
     Data = loadstastic(content)
     information = Word_Information(Data, FileName)
     information.list()
-    templist = content.split(' ')
-    PlotData = []
-    for i in range(information.TotalWordCount - 100):
-        temp = templist[i: i + 101]
-        PlotData.append(temp.count('the'))
+    PlotData = rollingwindow(content.split(), ['the'], 101)[('the', 101)].tolist()
 
     print
     print 'original dot number:', len(PlotData)
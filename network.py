@@ -1,33 +1,154 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from bisect import bisect_right
+
+
 def makenetwork(DataList):
+    """
+    this function makes a network for each column (attribute) of the data,
+    two rows are connected if they have the same value in that column,
+    or one of the value is the other one followed by '?' (an uncertain match)
+    the rows are grouped by value in a dictionary, so only the rows that match are ever compared
+
+    :param DataList: the data read by readdata(), the first row is the name of each column,
+                        the first column is the name of each node
+    :return: a dictionary map each column name to the network of that column
+                the network is a dictionary map a node to the array of the nodes it connects to (adjacency list)
+    """
     NetWorkData = {}
     for k in range(1, len(DataList[0])):
+        # map each value to the row numbers that have this value (in order)
+        Index = defaultdict(list)
+        for i in range(1, len(DataList)):
+            Index[DataList[i][k]].append(i)
+
         tempData = defaultdict(list)
         for i in range(1, len(DataList)):
-            for j in range(i+1, len(DataList)):
-                if DataList[i][k] == DataList[j][k] or \
-                                        DataList[i][k]+'?' == DataList[j][k] or DataList[i][k] == DataList[j][k]+'?':
-
-                    try:
-                        tempData[DataList[i][0]].append(DataList[j][0])
-                    except KeyError:
-                        tempData.update({DataList[i][0]: [DataList[j][0]]})
-                    try:
-                        tempData[DataList[j][0]].append(DataList[i][0])
-                    except KeyError:
-                        tempData.update({DataList[j][0]: DataList[i][0]})
-
-        NetWorkData.update({DataList[0][k]: tempData})
+            value = DataList[i][k]
+            Matches = Index[value][bisect_right(Index[value], i):]
+            for match in [value + '?'] + ([value[:-1]] if value.endswith('?') else []):
+                if match in Index:
+                    Rows = Index[match]
+                    Matches += Rows[bisect_right(Rows, i):]
+            for j in sorted(Matches):
+                tempData[DataList[i][0]].append(DataList[j][0])
+                tempData[DataList[j][0]].append(DataList[i][0])
+
+        NetWorkData.update({DataList[0][k]: dict(tempData)})
     return NetWorkData
 
+
+def shortestpath(network, key, node1, node2):
+    """
+    find the shortest path between two nodes with breadth first search
+
+    :param network: the result of makenetwork()
+    :param key: the column name, which network to use
+    :return: an array of the nodes on the path (from node1 to node2), None if the two nodes are not connected
+    """
+    Graph = network[key]
+    Parent = {node1: None}
+    Frontier = deque([node1])
+    while Frontier:
+        node = Frontier.popleft()
+        if node == node2:
+            Path = []
+            while node is not None:
+                Path.append(node)
+                node = Parent[node]
+            return Path[::-1]
+        for neighbour in Graph.get(node, []):
+            if neighbour not in Parent:
+                Parent[neighbour] = node
+                Frontier.append(neighbour)
+    return None
+
+
 def distance(network, key, node1, node2):
-    if node1 in network[key][node2]:
-        return 1
-    else:
-        temp = []
-        for node in network[key][node2]:
-            temp.append(distance(network, key, node, node2))
-        return min(temp)
+    """
+    the number of edges on the shortest path between two nodes
+
+    :param network: the result of makenetwork()
+    :param key: the column name, which network to use
+    :return: the distance, float('inf') if the two nodes are not connected
+    """
+    Path = shortestpath(network, key, node1, node2)
+    return float('inf') if Path is None else len(Path) - 1
+
+
+def neighbourhood(network, key, node, depth=1):
+    """
+    find all the nodes within depth steps from a node with breadth first search
+
+    :param network: the result of makenetwork()
+    :param key: the column name, which network to use
+    :param depth: the largest distance to go
+    :return: a dictionary map each node found to its distance from node (node itself is 0)
+    """
+    Graph = network[key]
+    Distance = {node: 0}
+    Frontier = [node]
+    for step in range(1, depth + 1):
+        NextFrontier = []
+        for current in Frontier:
+            for neighbour in Graph.get(current, []):
+                if neighbour not in Distance:
+                    Distance[neighbour] = step
+                    NextFrontier.append(neighbour)
+        Frontier = NextFrontier
+    return Distance
+
+
+def tomatrix(network, key):
+    """
+    convert a network into a sparse adjacency matrix
+
+    :param network: the result of makenetwork()
+    :param key: the column name, which network to use
+    :return: (the CSR adjacency matrix, an array of the node of each row (sorted))
+    """
+    from scipy.sparse import csr_matrix
+    Graph = network[key]
+    Nodes = sorted(set(Graph.keys()) | set(neighbour for neighbours in Graph.values() for neighbour in neighbours))
+    Index = dict((node, i) for i, node in enumerate(Nodes))
+    Rows = [Index[node] for node in Graph for neighbour in Graph[node]]
+    Columns = [Index[neighbour] for node in Graph for neighbour in Graph[node]]
+    Matrix = csr_matrix(([1] * len(Rows), (Rows, Columns)), shape=(len(Nodes), len(Nodes)))
+    return Matrix, Nodes
+
+
+def components(network, key):
+    """
+    find the connected components of a network
+
+    :param network: the result of makenetwork()
+    :param key: the column name, which network to use
+    :return: an array of components, each component is a sorted array of nodes, the largest component comes first
+    """
+    from scipy.sparse.csgraph import connected_components
+    Matrix, Nodes = tomatrix(network, key)
+    NumComponent, Labels = connected_components(Matrix, directed=False)
+    Result = [[] for i in range(NumComponent)]
+    for node, label in zip(Nodes, Labels):
+        Result[label].append(node)
+    return sorted(Result, key=lambda component: (-len(component), component))
+
+
+def distancematrix(network, key, sources=None):
+    """
+    the distance between all pairs of nodes (or from some nodes to all nodes), all done by scipy in one call
+
+    :param network: the result of makenetwork()
+    :param key: the column name, which network to use
+    :param sources: an array of nodes to compute the distance from, default is all the nodes
+                    (give a part of the nodes for large network, the result has len(sources) * number of node cells)
+    :return: (the distance matrix (inf if not connected), the nodes of the columns)
+                the rows are in the order of sources (or the same as the columns if sources is not given)
+    """
+    from scipy.sparse.csgraph import shortest_path
+    Matrix, Nodes = tomatrix(network, key)
+    Index = dict((node, i) for i, node in enumerate(Nodes))
+    indices = None if sources is None else [Index[node] for node in sources]
+    return shortest_path(Matrix, directed=False, unweighted=True, indices=indices), Nodes
 
 
 def readdata(content):
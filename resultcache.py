@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the memoisation of topword.testall(), topword.testgroup() and topword.KWtest():
+the result is kept under a key made of the fingerprint of the input (the content of every chunk) and the options,
+so asking the same analysis again (the same chunks, the same groups, the same option, Low and High)
+gives the stored result instead of computing it again.
+
+the fingerprint is computed from the content every time (it is much cheaper than the analysis),
+so changing a chunk, or dividing the chunks into groups differently (see topword.groupdivision()),
+always gives a different key, there is nothing to invalidate by hand.
+(a caller that knows the input does not change, like server.py with its resident corpora,
+can compute the fingerprint once and pass it in)
+
+the fingerprint of a chunk is python's hash of the frozenset of its items, which does not need any sort,
+it is the same in every process unless PYTHONHASHSEED is changed (then the directory only gives misses)
+
+the results are kept in an LRU bounded by the total size of their pickles (a copy is given on each hit),
+with an optional directory of the pickles as the second tier (also bounded by size, the least recently used are
+removed first). a ResultCache can be used from several threads.
+"""
+import os
+import hashlib
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+import numpy as np
+from topword import testall, testgroup, KWtest
+from wordmatrix import DocumentTermMatrix
+
+
+def chunkprint(wordlist):
+    """
+    :param wordlist: a dictionary map word to word count (or a WordCounts)
+    :return: the fingerprint of the chunk (an integer), it only depends on the words and their counts
+    """
+    return hash(frozenset(wordlist.iteritems() if isinstance(wordlist, dict) else wordlist.items()))
+
+
+def arrayprint(digest, array):
+    """
+    add a numpy array (its dtype, shape and content) to a hashlib digest
+    """
+    array = np.ascontiguousarray(array)
+    digest.update(array.dtype.str + repr(array.shape))
+    digest.update(array.data)
+
+
+def fingerprint(WordLists):
+    """
+    :param WordLists: an array contain dictionaries map from word to word count (or WordCounts),
+                        or a DocumentTermMatrix
+    :return: the fingerprint of the corpus (a hex string)
+    """
+    digest = hashlib.sha1()
+    if isinstance(WordLists, DocumentTermMatrix):
+        digest.update(repr(WordLists.words))
+        for array in (WordLists.counts.indptr, WordLists.counts.indices, WordLists.counts.data):
+            arrayprint(digest, array)
+    else:
+        for wordlist in WordLists:
+            digest.update('%d %d\0' % (len(wordlist), chunkprint(wordlist)))
+    return digest.hexdigest()
+
+
+def matrixprint(Matrixs, Words):
+    """
+    :return: the fingerprint of the input of topword.KWtest()
+    """
+    digest = hashlib.sha1(repr(list(Words)))
+    for matrix in Matrixs:
+        if hasattr(matrix, 'tocsr'):
+            matrix = matrix.tocsr()
+            for array in (matrix.indptr, matrix.indices, matrix.data):
+                arrayprint(digest, array)
+        elif isinstance(matrix, np.ndarray):
+            arrayprint(digest, matrix)
+        else:
+            digest.update(repr(matrix))
+        digest.update('\0')  # the end of a group
+    return digest.hexdigest()
+
+
+def makekey(parts):
+    """
+    :param parts: everything a result depends on (fingerprints and options), made of str, numbers, tuples and lists
+    :return: the key of the result (a hex string)
+    """
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def copyresult(result):
+    """
+    :return: a copy of a result of testall(), testgroup() or KWtest(), the lists and dictionaries inside are copied
+                (the tuples are shared), so changing the copy does not change the stored result
+    """
+    if isinstance(result, dict):
+        return dict((key, list(value) if isinstance(value, list) else value) for key, value in result.iteritems())
+    if isinstance(result, list):
+        return [list(value) if isinstance(value, list) else value for value in result]
+    return result
+
+
+class ResultCache(object):
+    def __init__(self, maxbytes=64 << 20, directory=None, maxdiskbytes=1 << 30):
+        """
+        :param maxbytes: the largest total size of the results kept in memory (the size of their pickle)
+        :param directory: the directory of the second tier, default is only keeping the results in memory
+        :param maxdiskbytes: the largest total size of the results in the directory
+        """
+        self.maxbytes = maxbytes
+        self.directory = directory
+        self.maxdiskbytes = maxdiskbytes
+        self.Lock = threading.Lock()  # only held to change the indexes, never while pickling or reading files
+        self.Entries = OrderedDict()  # map key to (result, size), the least recently used first
+        self.Bytes = 0  # the total size of self.Entries
+        self.Counters = {'hits': 0, 'diskhits': 0, 'misses': 0}
+
+        # map the file name of each result in the directory to its size, the least recently used first
+        # (the directory is only read here, then this is kept up to date)
+        self.DiskSizes = OrderedDict()
+        self.DiskBytes = 0
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            Files = []
+            for name in os.listdir(directory):
+                if name.endswith('.pickle'):
+                    stat = os.stat(os.path.join(directory, name))
+                    Files.append((stat.st_mtime, name, stat.st_size))
+            self.DiskSizes = OrderedDict((name, size) for time, name, size in sorted(Files))
+            self.DiskBytes = sum(self.DiskSizes.values())
+
+    def entrypath(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        """
+        :return: (a copy of) the result stored under the key, None if there is none
+        """
+        with self.Lock:
+            entry = self.Entries.pop(key, None)
+            if entry is not None:
+                self.Entries[key] = entry  # mark as recently used
+                self.Counters['hits'] += 1
+        if entry is not None:
+            return copyresult(entry[0])
+
+        if self.directory is not None:
+            path = self.entrypath(key)
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+                result = pickle.loads(data)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                try:
+                    os.utime(path, None)  # mark as recently used
+                except OSError:
+                    pass
+                with self.Lock:
+                    self.diskused(key + '.pickle', len(data))
+                    self.remember(key, result, len(data))
+                    self.Counters['diskhits'] += 1
+                return copyresult(result)
+        with self.Lock:
+            self.Counters['misses'] += 1
+        return None
+
+    def remember(self, key, result, size):
+        """
+        keep a result in memory, and drop the least recently used ones beyond self.maxbytes (hold self.Lock)
+        """
+        if key in self.Entries:
+            self.Bytes -= self.Entries.pop(key)[1]
+        if size > self.maxbytes:
+            return
+        self.Entries[key] = (result, size)
+        self.Bytes += size
+        while self.Bytes > self.maxbytes:
+            self.Bytes -= self.Entries.popitem(last=False)[1][1]
+
+    def diskused(self, name, size):
+        """
+        mark a file in the directory as the most recently used, and update its size (hold self.Lock)
+        """
+        self.DiskBytes += size - self.DiskSizes.pop(name, 0)
+        self.DiskSizes[name] = size
+
+    def put(self, key, result):
+        """
+        store a result under the key (in memory, and in the directory if there is one)
+        """
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        result = copyresult(result)  # the caller can change the one it has
+        with self.Lock:
+            self.remember(key, result, len(data))
+        if self.directory is not None:
+            # write to a temporary file first, so that a half written entry is never read
+            path = self.entrypath(key)
+            with open('%s.%d.tmp' % (path, threading.current_thread().ident), 'wb') as file:
+                file.write(data)
+            os.rename(file.name, path)
+            with self.Lock:
+                self.diskused(key + '.pickle', len(data))
+                Removed = self.evict()
+            for name in Removed:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass  # already removed by another cache on the same directory
+
+    def evict(self):
+        """
+        drop the least recently used files from the index until the total size is within self.maxdiskbytes
+        (hold self.Lock)
+
+        :return: the names of the files to remove
+        """
+        Removed = []
+        while self.DiskBytes > self.maxdiskbytes and self.DiskSizes:
+            name, size = self.DiskSizes.popitem(last=False)
+            self.DiskBytes -= size
+            Removed.append(name)
+        return Removed
+
+    def clear(self):
+        """
+        forget every result (in memory and in the directory)
+        """
+        with self.Lock:
+            self.Entries.clear()
+            self.Bytes = 0
+            self.DiskSizes.clear()
+            self.DiskBytes = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def memoise(self, parts, function, *args, **kwargs):
+        """
+        :param parts: everything the result depends on (fingerprints and options), they make the key
+        :return: the stored result of the parts, or function(*args, **kwargs) (which is then stored)
+        """
+        key = makekey(parts)
+        result = self.get(key)
+        if result is None:
+            result = function(*args, **kwargs)
+            self.put(key, result)
+        return result
+
+    def testall(self, WordLists, option='CustomP', Low=0.0, High=1.0, vectorize=False, workers=None,
+                Fingerprint=None):
+        """
+        the memoised topword.testall() (see topword.testall() for the parameters and the return)
+
+        :param Fingerprint: fingerprint(WordLists) computed before (only if the WordLists have not changed since)
+        """
+        # the vectorized path can order the words with the same p_value differently, so it is part of the key
+        vectorized = bool(vectorize or workers > 1 or isinstance(WordLists, DocumentTermMatrix) or
+                          (len(WordLists) != 0 and not isinstance(WordLists[0], dict)))
+        if Fingerprint is None:
+            Fingerprint = fingerprint(WordLists)
+        parts = ('testall', Fingerprint, option, float(Low), float(High), vectorized)
+        return self.memoise(parts, testall, WordLists, option, Low, High, vectorize, workers)
+
+    def testgroup(self, GroupWordLists, option='CustomP', Low=0.0, High=1.0, vectorize=False, compare='group',
+                  workers=None, Fingerprints=None):
+        """
+        the memoised topword.testgroup() (see topword.testgroup() for the parameters and the return)
+        the groups are part of the key, so dividing the chunks differently gives a different result
+
+        :param Fingerprints: the fingerprint() of each group computed before
+                                (only if the groups have not changed since)
+        """
+        vectorized = bool(vectorize or workers > 1 or compare != 'group')
+        if Fingerprints is None:
+            Fingerprints = [fingerprint(Chunk) for Chunk in GroupWordLists]
+        parts = ('testgroup', tuple(Fingerprints), option, float(Low), float(High), compare, vectorized)
+        return self.memoise(parts, testgroup, GroupWordLists, option, Low, High, vectorize, compare, workers)
+
+    def KWtest(self, Matrixs, Words, workers=None, blocksize=1024, Fingerprint=None):
+        """
+        the memoised topword.KWtest() (see topword.KWtest() for the parameters and the return)
+
+        :param Fingerprint: matrixprint(Matrixs, Words) computed before (only if the input has not changed since)
+        """
+        if Fingerprint is None:
+            Fingerprint = matrixprint(Matrixs, Words)
+        parts = ('KWtest', Fingerprint)
+        return self.memoise(parts, KWtest, Matrixs, Words, workers, blocksize)
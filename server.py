@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is a local analysis server: the corpora and the networks are loaded once and kept in memory,
+so the front end does not pay for reading the files and merging the counts on each click.
+(only the word counts are kept, the rolling window reads the tokens of its file from disk on each request)
+
+the analyses are requested with plain HTTP/JSON on localhost:
+    POST /<method>      the body is a JSON object of the parameters (see Methods), the answer is {'result': ...}
+                        or {'error': ...} with the status 400 (bad request), 404 (no such corpus / method),
+                        413 (too large), 503 (busy, try again later) or 500
+    GET /status         the loaded corpora and networks, and the counters of the server
+
+everything goes through AnalysisServer.handle(method, params), which can be called directly (without any network).
+
+python 2 has no asyncio, so this is a threading HTTP server (one thread waits on each request),
+the CPU heavy work runs in a process pool. the pool is started by the first request after the data is loaded,
+so the workers get the corpora with fork() instead of having them pickled with every request.
+identical requests running at the same time are computed once (the later ones wait for the first),
+the answers are memoised in a resultcache.ResultCache (keyed by the fingerprint of the corpus or the network
+and the parameters, so asking the same analysis again is answered at once),
+and a request whose cost (about the number of word it goes through) is large needs one of a few
+'large' slots, so one huge request can not take every worker.
+
+usage:
+    python server.py --corpus shakespeare=TestSuite --network network=network --workers 4 --port 8765
+    curl -d '{"corpus": "shakespeare", "option": "TopStdE"}' localhost:8765/testall
+"""
+import os
+import json
+import hashlib
+import threading
+import argparse
+import SocketServer
+import BaseHTTPServer
+from multiprocessing import Pool
+from corpus import loadcorpus, findfiles
+from topword import testall, testgroup, sort, groupdivision, FrequencyIndex
+from wordmatrix import DocumentTermMatrix
+from linearplot import rollingwindow, reduceplot
+from resultcache import ResultCache, fingerprint, makekey
+from network import makenetwork, readdata, shortestpath, distance, neighbourhood, components
+
+Served = {'corpora': {}, 'networks': {}}  # the loaded data, at module level so that the forked workers have it
+Options = ['CustomP', 'CustomF', 'TopStdE', 'MidStdE', 'LowStdE', 'TopIQR', 'MidIQR', 'LowIQR']
+ReduceMethods = ['r', 'fast', 'rdp', 'vw']  # see linearplot.reduceplot()
+Compares = ['group', 'rest']  # see topword.testgroup()
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        """
+        an error caused by the request, answered with the status and the message
+        """
+        Exception.__init__(self, message)
+        self.status = status
+
+
+# the methods, each takes the parameters (a dictionary) and gives a result that can be written as JSON
+# they run in the worker processes, and only read Served
+
+def checkparams(params):
+    """
+    check the parameters used to find the data (they are used as dictionary keys before any method runs)
+    """
+    for name in ('corpus', 'network'):
+        if name in params and not isinstance(params[name], basestring):
+            raise RequestError(400, '%s should be a string' % name)
+
+
+def errorstatus(error):
+    """
+    :return: (the HTTP status, the message) to answer an error raised by a method or a cost function
+    """
+    if isinstance(error, RequestError):
+        return error.status, str(error)
+    if isinstance(error, (KeyError, ValueError, TypeError, IndexError)):
+        return 400, '%s: %s' % (type(error).__name__, error)
+    return 500, '%s: %s' % (type(error).__name__, error)
+
+
+def getcorpus(params):
+    try:
+        return Served['corpora'][params['corpus']]
+    except KeyError:
+        raise RequestError(404, 'no corpus %r' % params.get('corpus'))
+
+
+def getnetwork(params):
+    try:
+        return Served['networks'][params['network']]
+    except KeyError:
+        raise RequestError(404, 'no network %r' % params.get('network'))
+
+
+def getoption(params):
+    """
+    :return: (option, Low, High) of the request, checked here since topword exits on an unknown option
+    """
+    option = params.get('option', 'CustomP')
+    if option not in Options:
+        raise RequestError(400, 'unknown option %r' % option)
+    return option, float(params.get('Low', 0.0)), float(params.get('High', 1.0))
+
+
+def getchoice(params, name, default, choices):
+    """
+    :return: the parameter, checked to be one of the choices (the functions fall back to a default on a bad value)
+    """
+    value = params.get(name, default)
+    if value not in choices:
+        raise RequestError(400, 'unknown %s %r, should be one of %s' % (name, value, ', '.join(choices)))
+    return value
+
+
+def dotestall(params):
+    """
+    parameters: corpus, option, Low, High (see topword.testall())
+    :return: the result of testall()
+    """
+    option, Low, High = getoption(params)
+    corpus = getcorpus(params)
+    return testall(corpus['Matrix'], option, Low, High, Index=corpus['Index'])
+
+
+def dosort(params):
+    """
+    parameters: corpus, option, Low, High, top_k, threshold (see topword.testall() and topword.sort())
+    :return: the result of sort(), an array of (chunk number, word, p_value)
+    """
+    return sort(dotestall(params), params.get('top_k'), params.get('threshold'))
+
+
+def dotestgroup(params):
+    """
+    parameters: corpus, groups (an array of the file numbers in each group, see topword.groupdivision()),
+                option, Low, High, compare (see topword.testgroup())
+    :return: an array of (group number 1, list number, group number 2, the sorted (word, p_value) list),
+                sorted by the first three
+    """
+    option, Low, High = getoption(params)
+    WordLists = getcorpus(params)['WordLists']
+    try:
+        Groups = groupdivision(WordLists, [list(group) for group in params['groups']])
+    except Exception as error:  # groupdivision() raises Exception if two groups are the same
+        raise RequestError(400, 'bad groups: %s' % error)
+    compare = getchoice(params, 'compare', 'group', Compares)
+    Result = testgroup(Groups, option, Low, High, vectorize=True, compare=compare)
+    return [list(key) + [value] for key, value in sorted(Result.items())]
+
+
+def dorollingwindow(params):
+    """
+    parameters: corpus, file (the file number), targets, sizes, proportion (see linearplot.rollingwindow()),
+                reduce (the method of linearplot.reduceplot(), the full data is given if this is not given),
+                tolerance
+    :return: an array of (target, window size, the points), the points are the y coordinates,
+                or (x, y) if reduce is given
+    (the tokens are not kept in memory, the file is read from disk for each request,
+    which costs little compared to the rolling window itself)
+    """
+    Paths = getcorpus(params)['Paths']
+    method = getchoice(params, 'reduce', None, ReduceMethods) if params.get('reduce') else None
+    try:
+        path = Paths[params['file']]
+    except (KeyError, IndexError, TypeError):
+        raise RequestError(400, 'bad file number %r' % params.get('file'))
+    with open(path, 'r') as file:
+        Tokens = file.read().split()
+    Targets = [target if isinstance(target, basestring) else tuple(target) for target in params['targets']]
+    Data = rollingwindow(Tokens, Targets, params.get('sizes', 101), params.get('proportion', False))
+    Result = []
+    for (target, size), points in sorted(Data.items()):
+        if method:
+            points = reduceplot(points, method=method, tolerance=params.get('tolerance', 1.0))
+        else:
+            points = points.tolist()
+        Result.append([target, size, points])
+    return Result
+
+
+def doreduceplot(params):
+    """
+    parameters: data (the y coordinates), start, method, tolerance, LeastCoDe, forcedistant
+                (see linearplot.reduceplot())
+    :return: the (x, y) of the points to plot
+    """
+    return reduceplot(params['data'], params.get('start', 0), params.get('LeastCoDe', 0),
+                      params.get('forcedistant', 300), getchoice(params, 'method', 'fast', ReduceMethods),
+                      params.get('tolerance', 1.0))
+
+
+def donetwork(params):
+    """
+    parameters: network, key (the column), query ('shortestpath', 'distance', 'neighbourhood' or 'components'),
+                node1 and node2 (for shortestpath and distance), node and depth (for neighbourhood)
+    :return: the result of the function of the query in network.py (the distance is None if not connected)
+    """
+    Network = getnetwork(params)
+    key = params.get('key')
+    if key not in Network:
+        raise RequestError(404, 'no column %r in the network' % key)
+    query = params.get('query')
+    if query == 'shortestpath':
+        return shortestpath(Network, key, params['node1'], params['node2'])
+    elif query == 'distance':
+        result = distance(Network, key, params['node1'], params['node2'])
+        return None if result == float('inf') else result
+    elif query == 'neighbourhood':
+        return neighbourhood(Network, key, params['node'], params.get('depth', 1))
+    elif query == 'components':
+        return components(Network, key)
+    raise RequestError(400, 'unknown query %r' % query)
+
+
+def corpuscost(params):
+    return Served['corpora'][params['corpus']]['WordCount'] if params.get('corpus') in Served['corpora'] else 0
+
+
+def rollingcost(params):
+    corpus = Served['corpora'].get(params.get('corpus'))
+    if corpus is None or not isinstance(params.get('file'), int) or not 0 <= params['file'] < len(corpus['Sizes']):
+        return 0
+    sizes = params.get('sizes', 101)
+    return corpus['Sizes'][params['file']] * len(params.get('targets', [])) * \
+        (1 if isinstance(sizes, int) else len(sizes))
+
+
+def groupcost(params):
+    return corpuscost(params) * max(len(params.get('groups', [])) - 1, 1)
+
+
+# map method name to (the function, the function estimating its cost from the parameters)
+Methods = {'testall': (dotestall, corpuscost),
+           'sort': (dosort, corpuscost),
+           'testgroup': (dotestgroup, groupcost),
+           'rollingwindow': (dorollingwindow, rollingcost),
+           'reduceplot': (doreduceplot, lambda params: len(params.get('data', []))),
+           'network': (donetwork, lambda params: 0)}
+
+
+def runmethod(task):
+    """
+    run a method (in a worker process, or in the thread of the request if there is no pool)
+
+    :param task: (method name, parameters)
+    :return: ('ok', the result) or ('error', status, message), the errors are returned (not raised),
+                so that they are not lost on the way back from the worker
+    """
+    method, params = task
+    try:
+        return 'ok', Methods[method][0](params)
+    except Exception as error:
+        return ('error',) + errorstatus(error)
+
+
+class Job(object):
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # the result of runmethod()
+
+
+class AnalysisServer(object):
+    def __init__(self, workers=None, maxrunning=16, largecost=5 * 10 ** 6, largeslots=1, maxcost=10 ** 9,
+                 timeout=3600, results=None):
+        """
+        :param workers: the number of worker process, default is running the methods in the thread of each request
+        :param maxrunning: the most different requests computed at the same time, the others get 503
+        :param largecost: a request costing this much (see Methods) is large
+        :param largeslots: the most large requests computed at the same time (keep it below workers,
+                            so the small requests always have a worker)
+        :param maxcost: a request costing more than this is refused with 413
+        :param timeout: the most seconds a request can take
+        :param results: a resultcache.ResultCache to memoise the answers in, default is a new one in memory
+        """
+        self.workers = workers
+        self.largecost = largecost
+        self.maxcost = maxcost
+        self.timeout = timeout
+        self.Pool = None
+        self.Results = ResultCache() if results is None else results
+        self.NetworkPrints = {}  # map network name to the fingerprint of its file
+        self.Lock = threading.Lock()
+        self.Running = {}  # map the key of each request being computed to its Job
+        self.Slots = threading.BoundedSemaphore(maxrunning)
+        self.LargeSlots = threading.BoundedSemaphore(largeslots)
+        self.Counters = {'computed': 0, 'coalesced': 0, 'rejected': 0, 'memoised': 0}
+
+    def getpool(self):
+        """
+        :return: the process pool, it is started on first use (after the data is loaded)
+        """
+        with self.Lock:
+            if self.Pool is None:
+                self.Pool = Pool(self.workers)
+            return self.Pool
+
+    def restartpool(self):
+        """
+        drop the pool, so that the next request starts a new pool whose workers have the data just loaded
+        (the requests already running finish in the old pool)
+        """
+        with self.Lock:
+            OldPool, self.Pool = self.Pool, None
+        if OldPool is not None:
+            OldPool.close()
+
+    def loadcorpus(self, name, source, workers=None, cache=None):
+        """
+        load a corpus (see corpus.loadcorpus() for source, workers and cache)
+
+        :param name: the name the requests use
+        """
+        Paths = findfiles(source)
+        WordLists, FileNames = loadcorpus(Paths, workers, cache=cache)
+        Sizes = [sum(wordlist.values()) for wordlist in WordLists]
+        Matrix = DocumentTermMatrix.load(WordLists)  # testall() on the matrix is the same as vectorize=True
+        Served['corpora'][name] = {'WordLists': WordLists, 'FileNames': FileNames, 'Paths': Paths,
+                                   'Sizes': Sizes, 'WordCount': sum(Sizes), 'Fingerprint': fingerprint(WordLists),
+                                   'Matrix': Matrix, 'Index': FrequencyIndex.fromwordlists(Matrix)}
+        self.restartpool()
+
+    def loadnetwork(self, name, path):
+        """
+        load a network file (see network.readdata())
+
+        :param name: the name the requests use
+        """
+        with open(path, 'r') as file:
+            content = file.read()
+        Served['networks'][name] = makenetwork(readdata(content.strip('\n')))
+        self.NetworkPrints[name] = hashlib.sha1(content).hexdigest()  # part of the key of the memoised answers
+        self.restartpool()
+
+    def status(self):
+        return {'corpora': dict((name, {'files': corpus['FileNames'], 'words': corpus['WordCount']})
+                                for name, corpus in Served['corpora'].items()),
+                'networks': dict((name, sorted(network.keys())) for name, network in Served['networks'].items()),
+                'running': len(self.Running),
+                'counters': dict(self.Counters)}
+
+    def admit(self, cost):
+        """
+        take the slots a request needs
+
+        :return: the slots taken (to release when the request is done), None if the server is too busy
+        """
+        Taken = []
+        for slots in [self.Slots] + ([self.LargeSlots] if cost >= self.largecost else []):
+            if not slots.acquire(False):
+                for taken in Taken:
+                    taken.release()
+                return None
+            Taken.append(slots)
+        return Taken
+
+    def compute(self, method, params):
+        if not self.workers > 1:
+            return runmethod((method, params))
+        return self.getpool().apply_async(runmethod, [(method, params)]).get(self.timeout)
+
+    def handle(self, method, params):
+        """
+        answer a request
+
+        :param method: the name of the method (see Methods), or 'status'
+        :param params: a dictionary of the parameters
+        :return: (the HTTP status, the answer (a dictionary))
+        """
+        if method == 'status':
+            return 200, self.status()
+        if method not in Methods:
+            return 404, {'error': 'no method %r' % method}
+        if not isinstance(params, dict):
+            return 400, {'error': 'the parameters should be a JSON object'}
+        try:
+            checkparams(params)
+            cost = Methods[method][1](params)
+        except Exception as error:
+            status, message = errorstatus(error)
+            return status, {'error': message}
+        if cost > self.maxcost:
+            with self.Lock:
+                self.Counters['rejected'] += 1
+            return 413, {'error': 'the request is too large (cost %d, the most is %d)' % (cost, self.maxcost)}
+
+        key = json.dumps([method, params], sort_keys=True)
+        # the answer depends on the content of the corpus or the network, not only its name (it can be loaded again)
+        corpus = Served['corpora'].get(params.get('corpus'))
+        resultkey = makekey((key, corpus and corpus['Fingerprint'], self.NetworkPrints.get(params.get('network'))))
+        result = self.Results.get(resultkey)  # not under self.Lock, a result can be large (see ResultCache)
+        if result is not None:
+            with self.Lock:
+                self.Counters['memoised'] += 1
+            return 200, {'result': result}
+        with self.Lock:
+            job = self.Running.get(key)
+            owner = job is None
+            if owner:
+                Taken = self.admit(cost)
+                if Taken is None:
+                    self.Counters['rejected'] += 1
+                    return 503, {'error': 'the server is busy, try again later'}
+                job = self.Running[key] = Job()
+            else:
+                self.Counters['coalesced'] += 1
+
+        if owner:
+            try:
+                try:
+                    job.result = self.compute(method, params)
+                except Exception as error:
+                    job.result = ('error', 500, '%s: %s' % (type(error).__name__, error))
+                # memoised before the job is dropped from self.Running, so the same request is never computed twice
+                if job.result[0] == 'ok':
+                    try:
+                        self.Results.put(resultkey, job.result[1])
+                    except (IOError, OSError):
+                        pass  # the answer is still given, it is only not memoised
+            finally:
+                with self.Lock:
+                    del self.Running[key]
+                    self.Counters['computed'] += 1
+                for taken in Taken:
+                    taken.release()
+                job.done.set()
+        else:
+            job.done.wait(self.timeout)
+            if job.result is None:
+                return 500, {'error': 'the request timed out'}
+
+        if job.result[0] == 'ok':
+            return 200, {'result': job.result[1]}
+        return job.result[1], {'error': job.result[2]}
+
+    def close(self):
+        if self.Pool is not None:
+            self.Pool.close()
+            self.Pool.join()
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def answer(self, status, answer):
+        body = json.dumps(answer)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.answer(*self.server.analysis.handle(self.path.strip('/'), {}))
+
+    def do_POST(self):
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        except ValueError as error:
+            return self.answer(400, {'error': 'bad JSON: %s' % error})
+        self.answer(*self.server.analysis.handle(self.path.strip('/'), params))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, analysis):
+        """
+        :param address: (host, port), keep the host 127.0.0.1, there is no authentication
+        :param analysis: the AnalysisServer answering the requests
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.analysis = analysis
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='serve the analyses of MosesLexo on localhost')
+    parser.add_argument('--corpus', action='append', default=[], help='name=source of a corpus (see findfiles())')
+    parser.add_argument('--network', action='append', default=[], help='name=path of a network file')
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker process')
+    parser.add_argument('--cache', default=None, help='the directory of the word count cache')
+    parser.add_argument('--results', default=None, help='the directory to keep the memoised answers in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    analysis = AnalysisServer(args.workers, results=ResultCache(directory=args.results))
+    for item in args.corpus:
+        name, source = item.split('=', 1)
+        analysis.loadcorpus(name, source, args.workers, args.cache)
+    for item in args.network:
+        name, path = item.split('=', 1)
+        analysis.loadnetwork(name, os.path.expanduser(path))
+    server = ThreadingHTTPServer((args.host, args.port), analysis)
+    print 'serving on http://%s:%d' % (args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        analysis.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,29 @@ from __future__ import division
 # this program detects word anomaly using z-test for proportion
 # assume the possibility of a particular word appear in a text follows normal distribution
 # this program can be optimized in many way.
+# scipy is slow to import, so it is only imported on first use (see zprob())
 from math import sqrt
 from operator import itemgetter
-from scipy.stats.stats import zprob
-from extra import loadstastic, merge_list, matrixtodict
-from scipy.stats.mstats import kruskalwallis
-import numpy.ma as ma
+from heapq import merge
+from itertools import islice
+from extra import merge_list
+import numpy as np
+from wordmatrix import DocumentTermMatrix
+from workerpool import runpool, splittask
+from instrument import stage, count, enabled
+from corpus import loadcorpus
+import workerpool
+
+
+def zprob(z):
+    """
+    the cumulative distribution function of the standard normal distribution (scipy's zprob())
+    scipy.stats is imported on the first call, and this function replaces itself with scipy's,
+    so the later calls cost nothing extra
+    """
+    global zprob
+    from scipy.stats.stats import zprob
+    return zprob(z)
 
 
 def ztest(p1, pt, n1, nt):
@@ -41,49 +58,77 @@ def ztest(p1, pt, n1, nt):
         return 'Insignificant'
 
 
-def testall(WordLists, option='CustomP', Low=0.0, High=1.0):
+def ztestarray(p1, pt, n1, nt):
     """
-    this method takes Wordlist and and then analyze each single word(*compare to the total passage(all the chunks)*),
-    and then pack that into the return
+    the array version of ztest(), all the parameter can be numpy array (or number), and they are broadcast together
+    (see ztest() for the document of the parameters)
 
-    :param WordLists:   Array
-                        each element of array represent a chunk, and it is a dictionary type
-                        each element in the dictionary maps word inside that chunk to its frequency
+    :return: an array of the p_values, the p_value is nan where ztest() would return 'Insignificant'
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = (p1 * n1 + pt * nt) / (n1 + nt)
+        standard_error = np.sqrt(p * (1 - p) * ((1 / n1) + (1 / nt)))
+        z_scores = (p1 - pt) / standard_error
+        p_values = (1 - zprob(np.abs(z_scores))) * 2
+    return np.where(standard_error > 0, p_values, np.nan)  # nan is the same case as the exception in ztest()
 
-    :param option:  some default option to set for High And Low(see the document for High and Low)
-                    1. using standard deviation to find outlier
-                        TopStdE: only analyze the Right outlier of word, determined by standard deviation
-                                    (word frequency > average + 2 * Standard_Deviation)
-                        MidStdE: only analyze the Non-Outlier of word, determined by standard deviation
-                                    (average + 2 * Standard_Deviation > word frequency > average - 2 * Standard_Deviation)
-                        LowStdE: only analyze the Left Outlier of word, determined by standard deviation
-                                    (average - 2 * Standard_Deviation > word frequency)
 
-                    2. using IQR to find outlier *THIS METHOD DO NOT WORK WELL, BECAUSE THE DATA USUALLY ARE HIGHLY SKEWED*
-                        TopIQR: only analyze the Top outlier of word, determined by IQR
-                                    (word frequency > median + 1.5 * Standard)
-                        MidIQR: only analyze the non-outlier of word, determined by IQR
-                                    (median + 1.5 * Standard > word frequency > median - 1.5 * Standard)
-                        LowIQR: only analyze the Left outlier of word, determined by IQR
-                                    (median - 1.5 * Standard > word frequency)
+def countresult(p_values, NumWord):
+    """
+    count the z-test done, the words filtered out by the Low/High band and the 'Insignificant' results
+    (see instrument, this is only called while recording)
 
-    :param Low:  this method will only analyze the word with higher frequency than this value
-                    (this parameter will be overwritten if the option is not 'Custom')
-    :param High: this method will only analyze the word with lower frequency than this value
-                    (this parameter will be overwritten if the option is not 'Custom')
+    :param p_values: the p_values of the words tested (a list of ztest() results, or the array of ztestarray())
+    :param NumWord: the number of word considered (tested or filtered)
+    """
+    if isinstance(p_values, np.ndarray):
+        Insignificant = np.count_nonzero(np.isnan(p_values))
+    else:
+        Insignificant = sum(1 for p_value in p_values if isinstance(p_value, str))  # 'Insignificant'
+    count('ztest', len(p_values))
+    count('band_filtered', NumWord - len(p_values))
+    count('insignificant', Insignificant)
 
-    :return:    contain a array
-                each element of array is a array, represent a chunk and it is sorted via p_value
-                each element array is a tuple: (word, corresponding p_value)
+
+def sortresult(columns, p_values):
     """
+    sort the result of ztestarray() via p_value, the 'Insignificant' (nan) are put to the end
+    (the same as the sorted() in testall())
 
-    # init
-    MergeList = merge_list(WordLists)
-    AllResults = []  # the value to return
-    TotalWordCount = sum(MergeList.values())
-    NumWord = len(MergeList)
+    :param columns: the column number of the words that are tested
+    :param p_values: the corresponding p_value (nan means 'Insignificant')
+    :return: (the sorted columns, the sorted p_values)
+    """
+    order = np.argsort(np.where(np.isnan(p_values), np.inf, p_values), kind='mergesort')
+    return columns[order], p_values[order]
 
-    # option
+
+def packresult(words, columns, p_values):
+    """
+    pack the sorted result (see sortresult()) into the (word, p_value) list that testall() returns
+
+    :param words: the word list of the DocumentTermMatrix
+    :param columns: the sorted column number of the words that are tested
+    :param p_values: the corresponding p_value (nan means 'Insignificant')
+    :return: a array of tuple: (word, corresponding p_value)
+    """
+    return [(words[column], 'Insignificant' if p_value != p_value else p_value)
+            for column, p_value in zip(columns.tolist(), p_values.tolist())]
+
+
+def resolvebound(option, Low, High, TotalWordCount, NumWord, SquareDeviation, Quantile):
+    """
+    resolve the option of testall() into the actual Low and High, from the statistics of the merged word counts
+    (see the document for testall() for the detail of the option, Low and High)
+
+    :param TotalWordCount: the total word count of all the chunks
+    :param NumWord: the number of different word in all the chunks
+    :param SquareDeviation: a function gives the sum of (word count - average word count) ^ 2 of all the words
+                            (only called for the StdE options)
+    :param Quantile: a function takes a position, gives the word count at that position
+                        if all the word counts are sorted (only called for the IQR options)
+    :return: (Low, High)
+    """
     if option == 'CustomP':
         pass
 
@@ -92,50 +137,34 @@ def testall(WordLists, option='CustomP', Low=0.0, High=1.0):
         High /= NumWord
 
     elif option.endswith('StdE'):
-        StdE = 0
         Average = TotalWordCount / NumWord
-        for word in MergeList:
-            StdE += (MergeList[word] - Average) ** 2
-        StdE = sqrt(StdE)
+        StdE = sqrt(SquareDeviation())
         StdE /= NumWord
 
         if option.startswith('Top'):
-            # TopStdE: only analyze the Right outlier of word, determined by standard deviation
             Low = (Average + 2 * StdE) / NumWord
-
         elif option.startswith('Mid'):
-            # MidStdE: only analyze the Non-Outlier of word, determined by standard deviation
             High = (Average + 2 * StdE) / NumWord
             Low = (Average - 2 * StdE) / NumWord
-
         elif option.startswith('Low'):
-            # LowStdE: only analyze the Left Outlier of word, determined by standard deviation
             High = (Average - 2 * StdE) / NumWord
-
         else:
             print('input error')
             exit(-1)
 
     elif option.endswith('IQR'):
-        TempList = sorted(MergeList.items(), key=itemgetter(1))
-        Mid = TempList[int(NumWord / 2)][1]
-        Q3 = TempList[int(NumWord * 3 / 4)][1]
-        Q1 = TempList[int(NumWord / 4)][1]
+        Mid = Quantile(int(NumWord / 2))
+        Q3 = Quantile(int(NumWord * 3 / 4))
+        Q1 = Quantile(int(NumWord / 4))
         IQR = Q3 - Q1
 
         if option.startswith('Top'):
-            # TopIQR: only analyze the Top outlier of word, determined by IQR
             Low = (Mid + 1.5 * IQR) / TotalWordCount
-
         elif option.startswith('Mid'):
-            # MidIQR: only analyze the non-outlier of word, determined by IQR
             High = (Mid + 1.5 * IQR) / TotalWordCount
             Low = (Mid - 1.5 * IQR) / TotalWordCount
-
         elif option.startswith('Low'):
-            # LowIQR: only analyze the Left outlier of word, determined by IQR
             High = (Mid - 1.5 * IQR) / TotalWordCount
-
         else:
             print('input error')
             exit(-1)
@@ -144,24 +173,292 @@ def testall(WordLists, option='CustomP', Low=0.0, High=1.0):
         print('input error')
         exit(-1)
 
-    # calculation
-    for wordlist in WordLists:
-        ResultList = {}
-        ListWordCount = sum(wordlist.values())
+    return Low, High
+
+
+class FrequencyIndex(object):
+    def __init__(self, Counts, Words=None):
+        """
+        the merged word counts of a corpus, with the statistics the options of testall() need cached,
+        build it once (see fromwordlists()) and pass it to testall() / testgroup() to reuse it between the calls.
+        the counts are only sorted when an order statistic is needed (the IQR options, band()):
+        since the proportion of a word (count / total word count) grows with its count, the words
+        with Low < proportion < High are then a continuous range of the sorted order (the band),
+        found with a binary search
+
+        :param Counts: the word count of each word in all the chunks (the values of merge_list())
+        :param Words: an parallel array of Counts, the word of each count (needed by bandwords() and inbandwords())
+        """
+        self.Counts = np.asarray(Counts)
+        self.Words = Words
+        self.NumWord = len(self.Counts)
+        self.TotalWordCount = self.Counts.sum().item()
+        self.Props = self.Counts / self.TotalWordCount if self.NumWord else self.Counts.astype(float)
+        self.SquareDeviation = None  # sum of (word count - average word count) ^ 2, calculated on first use
+        self.Order = None  # the position (in Counts) of each count after sorting, calculated on first use
+        self.Sorted = None  # the sorted counts
+        self.SortedProps = None  # the sorted proportions
+
+    @classmethod
+    def fromdict(cls, MergeList):
+        """
+        :param MergeList: a dictionary map word to its word count in all the chunks (see extra.merge_list())
+        :return: the FrequencyIndex of the words
+        """
+        return cls(np.array(MergeList.values()), MergeList.keys())
+
+    @classmethod
+    def fromwordlists(cls, WordLists):
+        """
+        :param WordLists: an array contain dictionaries map from word to word count, or a DocumentTermMatrix
+        :return: the FrequencyIndex of the merged word counts of all the chunks
+        """
+        if isinstance(WordLists, DocumentTermMatrix):
+            return cls(WordLists.mergecounts(), WordLists.words)
+        return cls.fromdict(merge_list(WordLists))
+
+    def sort(self):
+        if self.Order is None:
+            self.Order = np.argsort(self.Counts, kind='mergesort')
+            self.Sorted = self.Counts[self.Order]
+            self.SortedProps = self.Props[self.Order]
+
+    def squaredeviation(self):
+        if self.SquareDeviation is None:
+            Deviation = self.Counts - self.TotalWordCount / self.NumWord
+            self.SquareDeviation = np.dot(Deviation, Deviation)
+        return self.SquareDeviation
+
+    def quantile(self, position):
+        """
+        :return: the word count at the position in the sorted counts
+        """
+        self.sort()
+        return self.Sorted[position].item()
+
+    def bound(self, option='CustomP', Low=0.0, High=1.0):
+        """
+        resolve the option of testall() into the actual Low and High
+        (see the document for testall() for the detail of the option, Low and High)
+
+        :return: (Low, High)
+        """
+        return resolvebound(option, Low, High, self.TotalWordCount, self.NumWord, self.squaredeviation,
+                            self.quantile)
+
+    def inband(self, Low, High):
+        """
+        :return: a bool array parallel to Counts, whether the word has Low < proportion < High (no sort needed)
+        """
+        return (self.Props > Low) & (self.Props < High)
+
+    def inbandwords(self, Low, High):
+        """
+        :return: an array of the words with Low < proportion < High, in the order of Counts
+        """
+        return [self.Words[column] for column in np.flatnonzero(self.inband(Low, High)).tolist()]
+
+    def band(self, Low, High):
+        """
+        :return: (first, last), the words from position first to last (not included) in the sorted order
+                    are all the words with Low < proportion < High
+        """
+        self.sort()
+        first = np.searchsorted(self.SortedProps, Low, side='right')
+        last = np.searchsorted(self.SortedProps, High, side='left')
+        return first, max(first, last)
+
+    def bandcolumns(self, Low, High):
+        """
+        :return: an array of the position (in Counts) of the words with Low < proportion < High
+        """
+        first, last = self.band(Low, High)
+        return self.Order[first:last]
+
+    def bandwords(self, Low, High):
+        """
+        :return: an array of the words with Low < proportion < High, from the least frequent
+        """
+        return [self.Words[column] for column in self.bandcolumns(Low, High).tolist()]
+
+
+def testrows(Data, start, end):
+    """
+    do the z-test for the chunk from start to end, this is the work of testmatrix() for a part of the chunks
+
+    :param Data: a dictionary contain the CSR arrays of the DocumentTermMatrix ('indptr', 'indices', 'data'),
+                    the total word count of each chunk ('ChunkTotals'), the proportion of each word in all the chunks
+                    ('MergeProps'), whether each word is in the band of word to analyze ('InBand')
+                    and the total word count of all the chunks ('TotalWordCount')
+    :return: an array of the sorted result (see sortresult()) of each chunk
+    """
+    indptr, indices, data = Data['indptr'], Data['indices'], Data['data']
+    TotalWordCount = Data['TotalWordCount']
+    Counting = enabled()
+    Results = []
+    for i in range(start, end):
+        ListWordCount = Data['ChunkTotals'][i]
+        columns, counts = indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]]
+        selected = Data['InBand'][columns]
+        columns, counts = columns[selected], counts[selected]
+        p_values = ztestarray(counts / ListWordCount, Data['MergeProps'][columns], ListWordCount, TotalWordCount)
+        if Counting:
+            countresult(p_values, len(selected))
+        with stage('testall/sort'):
+            Results.append(sortresult(columns, p_values))
+    return Results
+
+
+def testrowsworker(task):
+    """
+    testrows() in a worker process of workerpool.runpool()
+    """
+    return testrows(workerpool.SharedData, *task)
+
+
+def testmatrix(Matrix, option='CustomP', Low=0.0, High=1.0, workers=None, Index=None):
+    """
+    the DocumentTermMatrix version of testall(), all the z-test are done with array operation
+    (see testall() for the document of option, Low, High, workers, Index and the return)
+
+    :param Matrix: a DocumentTermMatrix, WordLists, or the matrix generated by getMatrix method
+    """
+    with stage('testall/matrix'):
+        Matrix = DocumentTermMatrix.load(Matrix)
+        MergeCounts = Matrix.mergecounts()
+        TotalWordCount = MergeCounts.sum()
+    with stage('testall/bound'):
+        if Index is None:
+            Index = FrequencyIndex(MergeCounts, Matrix.words)
+        if Index.Words is Matrix.words:
+            InBand = Index.inband(*Index.bound(option, Low, High))
+        else:  # an index given by the caller, its words can be in another order
+            InBand = np.zeros(len(MergeCounts), dtype=bool)
+            InBand[[Matrix.index[word] for word in Index.inbandwords(*Index.bound(option, Low, High))]] = True
+    Data = {'indptr': Matrix.counts.indptr, 'indices': Matrix.counts.indices, 'data': Matrix.counts.data,
+            'ChunkTotals': Matrix.totals(), 'MergeProps': MergeCounts / TotalWordCount, 'InBand': InBand,
+            'TotalWordCount': TotalWordCount}
+
+    with stage('testall/ztest'):
+        if workers > 1:
+            Results = runpool(testrowsworker, splittask(len(Matrix), workers), workers, Data)
+        else:
+            Results = [testrows(Data, 0, len(Matrix))]
+
+    with stage('testall/pack'):
+        return [packresult(Matrix.words, columns, p_values) for result in Results for columns, p_values in result]
+
+
+def testall(WordLists, option='CustomP', Low=0.0, High=1.0, vectorize=False, workers=None, Index=None):
+    """
+    this method takes Wordlist and and then analyze each single word(*compare to the total passage(all the chunks)*),
+    and then pack that into the return
+
+    :param WordLists:   Array
+                        each element of array represent a chunk, and it is a dictionary type
+                        each element in the dictionary maps word inside that chunk to its frequency
+
+    :param option:  some default option to set for High And Low(see the document for High and Low)
+                    1. using standard deviation to find outlier
+                        TopStdE: only analyze the Right outlier of word, determined by standard deviation
+                                    (word frequency > average + 2 * Standard_Deviation)
+                        MidStdE: only analyze the Non-Outlier of word, determined by standard deviation
+                                    (average + 2 * Standard_Deviation > word frequency > average - 2 * Standard_Deviation)
+                        LowStdE: only analyze the Left Outlier of word, determined by standard deviation
+                                    (average - 2 * Standard_Deviation > word frequency)
+
+                    2. using IQR to find outlier *THIS METHOD DO NOT WORK WELL, BECAUSE THE DATA USUALLY ARE HIGHLY SKEWED*
+                        TopIQR: only analyze the Top outlier of word, determined by IQR
+                                    (word frequency > median + 1.5 * Standard)
+                        MidIQR: only analyze the non-outlier of word, determined by IQR
+                                    (median + 1.5 * Standard > word frequency > median - 1.5 * Standard)
+                        LowIQR: only analyze the Left outlier of word, determined by IQR
+                                    (median - 1.5 * Standard > word frequency)
+
+    :param Low:  this method will only analyze the word with higher frequency than this value
+                    (this parameter will be overwritten if the option is not 'Custom')
+    :param High: this method will only analyze the word with lower frequency than this value
+                    (this parameter will be overwritten if the option is not 'Custom')
+
+    :param vectorize: use the DocumentTermMatrix (see testmatrix()) to do all the z-test with array operation,
+                        this is much faster on large corpus.
+                        (WordLists can also be a DocumentTermMatrix or the matrix generated by getMatrix method,
+                        in which case this is always used)
+
+    :param workers: the number of process to spread the chunks across (this implies vectorize),
+                    the result is exactly the same as vectorize=True in one process: the same p_values as the
+                    default (dictionary) way, but the words with the same p_value can be in a different order
+
+    :param Index: the FrequencyIndex of all the chunks (see FrequencyIndex.fromwordlists()), made once and reused
+                    when the same WordLists are analyzed several times, default is making a new one
+
+    :return:    contain a array
+                each element of array is a array, represent a chunk and it is sorted via p_value
+                each element array is a tuple: (word, corresponding p_value)
+    """
+
+    if vectorize or workers > 1 or isinstance(WordLists, DocumentTermMatrix) or \
+            (len(WordLists) != 0 and not isinstance(WordLists[0], dict)):
+        return testmatrix(WordLists, option, Low, High, workers, Index)
 
-        for word in wordlist.keys():
-            if Low < MergeList[word] / TotalWordCount < High:
-                p_value = ztest(wordlist[word] / ListWordCount, MergeList[word] / TotalWordCount,
-                                ListWordCount, TotalWordCount)
-                ResultList.update({word: p_value})
+    # init
+    MergeList = merge_list(WordLists)
+    AllResults = []  # the value to return
+    TotalWordCount = sum(MergeList.values())
 
-        ResultList = sorted(ResultList.items(), key=itemgetter(1))
-        AllResults.append(ResultList)
+    # option: the words to analyze (see FrequencyIndex)
+    with stage('testall/bound'):
+        if Index is None:
+            Index = FrequencyIndex.fromdict(MergeList)
+        Band = set(Index.inbandwords(*Index.bound(option, Low, High)))
 
+    # calculation
+    Counting = enabled()
+    with stage('testall/ztest'):
+        for wordlist in WordLists:
+            ResultList = {}
+            ListWordCount = sum(wordlist.values())
+
+            for word in wordlist.keys():
+                if word in Band:
+                    p_value = ztest(wordlist[word] / ListWordCount, MergeList[word] / TotalWordCount,
+                                    ListWordCount, TotalWordCount)
+                    ResultList.update({word: p_value})
+
+            if Counting:
+                countresult(ResultList.values(), len(wordlist))
+            AllResults.append(ResultList)
+
+    with stage('testall/sort'):
+        AllResults = [sorted(ResultList.items(), key=itemgetter(1)) for ResultList in AllResults]
     return AllResults
 
 
-def sort(word_p_lists):
+def isort(word_p_lists, threshold=None):
+    """
+    the lazy version of sort(): the lists of all the chunks (each already sorted via p_value, as testall() gives)
+    are merged with a heap, so the most abnormal words come out first without sorting everything
+
+    :param word_p_lists: the result of testall() (each element is a sorted array of (word, p_value))
+    :param threshold: stop at the first p_value larger than this
+    :return: a generator gives the tuples of sort() in the same order:
+                (the chunk it belong(the number of chunk in the word_p_list), the word, the corresponding p_value)
+    """
+    def chunkitems(chunknumber, wordlist):
+        for position, (word, p_value) in enumerate(wordlist):
+            if p_value == 'Insignificant':
+                continue
+            if threshold is not None and p_value > threshold:
+                break
+            # the chunk number and position keep the same order as the stable sort in sort()
+            yield p_value, chunknumber, position, word
+
+    for p_value, chunknumber, position, word in merge(*[chunkitems(i + 1, wordlist)
+                                                        for i, wordlist in enumerate(word_p_lists)]):
+        yield chunknumber, word, p_value
+
+
+def sort(word_p_lists, top_k=None, threshold=None):
     """
     this method combine all the diction in word_p_list(word with its p_value) into totallist,
     with a mark to indicate which file the element(word with p_value) belongs to
@@ -170,11 +467,18 @@ def sort(word_p_lists):
     :param word_p_lists: a array of dictionary
                             each element of array represent a chunk, and it is a dictionary type
                             each element in the dictionary maps word inside that chunk to its p_value
+    :param top_k: only give the top_k most abnormal words
+    :param threshold: only give the words with p_value not larger than this
+                        (if top_k or threshold is given, each element of word_p_lists must already be sorted via
+                        p_value (as testall() gives), and the result is taken from isort() in O(n log k) time)
     :return: a array of tuple type (sorted via p_value):
                 each element is a tuple:    (the chunk it belong(the number of chunk in the word_p_list),
                                             the word, the corresponding p_value)
 
     """
+    if top_k is not None or threshold is not None:
+        return [item for item in islice(isort(word_p_lists, threshold), top_k)]
+
     totallist = []
     i = 0
     for list in word_p_lists:
@@ -206,7 +510,109 @@ def groupdivision(WordLists, ChunkMap):
     return ChunkMap
 
 
-def testgroup(GroupWordLists, option='CustomP', Low=0.0, High=1.0):
+def testgrouprows(Data, i, start, end, compare):
+    """
+    do the z-test for the chunk from start to end in group i, this is the work of testgroupmatrix() for a part of
+    the chunks
+
+    :param Data: a dictionary contain the CSR arrays of all the chunks ('indptr', 'indices', 'data'),
+                    the total word count of each chunk ('ChunkTotals'), the row number each group starts at
+                    ('GroupStarts'), the merged word count of each group ('GroupCounts') and its total
+                    ('GroupWordCounts'), and an array of (Low, High) ('Bound')
+    :param compare: see testgroup()
+    :return: an array of (the key in the result of testgroup(), the sorted result (see sortresult()))
+    """
+    indptr, GroupCounts, GroupWordCounts = Data['indptr'], Data['GroupCounts'], Data['GroupWordCounts']
+    Low, High = Data['Bound']
+    RowStart, RowEnd = Data['GroupStarts'][i] + start, Data['GroupStarts'][i] + end
+    RowNumbers = np.repeat(np.arange(start, end), np.diff(indptr[RowStart:RowEnd + 1]))
+    columns = Data['indices'][indptr[RowStart]:indptr[RowEnd]]
+    iTotalWordCount = Data['ChunkTotals'][Data['GroupStarts'][i] + RowNumbers]
+    iWordProp = Data['data'][indptr[RowStart]:indptr[RowEnd]] / iTotalWordCount
+    selected = (Low < iWordProp) & (iWordProp < High)
+    columns, RowNumbers = columns[selected], RowNumbers[selected]
+    iTotalWordCount, iWordProp = iTotalWordCount[selected], iWordProp[selected]
+    RowBounds = np.searchsorted(RowNumbers, np.arange(start, end + 1))
+
+    if compare == 'rest':
+        Targets = [('rest', GroupCounts.sum(axis=0) - GroupCounts[i], GroupWordCounts.sum() - GroupWordCounts[i])]
+    else:
+        Targets = [(j, GroupCounts[j], GroupWordCounts[j]) for j in range(len(GroupCounts)) if j != i]
+
+    Counting = enabled()
+    Results = []
+    for j, jCounts, jTotalWordCount in Targets:
+        p_values = ztestarray(iWordProp, jCounts[columns] / jTotalWordCount, iTotalWordCount, jTotalWordCount)
+        if Counting:
+            countresult(p_values, len(selected))
+        with stage('testgroup/sort'):
+            for wordlistnumber in range(start, end):
+                first, last = RowBounds[wordlistnumber - start], RowBounds[wordlistnumber - start + 1]
+                if first != last:
+                    Results.append(((i, wordlistnumber, j), sortresult(columns[first:last], p_values[first:last])))
+    return Results
+
+
+def testgrouprowsworker(task):
+    """
+    testgrouprows() in a worker process of workerpool.runpool()
+    """
+    return testgrouprows(workerpool.SharedData, *task)
+
+
+def testgroupmatrix(GroupWordLists, option='CustomP', Low=0.0, High=1.0, compare='group', workers=None,
+                    Index=None):
+    """
+    the array version of testgroup(), the total of each chunk and the merged count of each group are only calculated
+    once, and all the z-test of a chunk against a group are done in one array operation
+    (see testgroup() for the document of the parameters and the return)
+    """
+    # init
+    NumGroup = len(GroupWordLists)
+    GroupSizes = [len(Chunk) for Chunk in GroupWordLists]
+    GroupStarts = np.concatenate(([0], np.cumsum(GroupSizes))).astype(int)
+    with stage('testgroup/matrix'):
+        Matrix = DocumentTermMatrix.load([wordlist for Chunk in GroupWordLists for wordlist in Chunk])
+        GroupCounts = np.zeros((NumGroup, len(Matrix.words)))
+        for i in range(NumGroup):
+            GroupCounts[i] = np.asarray(Matrix.counts[GroupStarts[i]:GroupStarts[i + 1]].sum(axis=0)).ravel()
+        TotalCounts = GroupCounts.sum(axis=0)
+        TotalWordCount = TotalCounts.sum()
+
+    # option
+    with stage('testgroup/bound'):
+        if option == 'CustomF':
+            option, Low, High = 'CustomP', Low / TotalWordCount, High / TotalWordCount
+        if Index is None:
+            Index = FrequencyIndex(TotalCounts)
+        Low, High = Index.bound(option, Low, High)
+
+    # calculation
+    Data = {'indptr': Matrix.counts.indptr, 'indices': Matrix.counts.indices, 'data': Matrix.counts.data,
+            'ChunkTotals': Matrix.totals(), 'GroupStarts': GroupStarts, 'GroupCounts': GroupCounts,
+            'GroupWordCounts': GroupCounts.sum(axis=1), 'Bound': np.array([Low, High], dtype=float)}
+    with stage('testgroup/ztest'):
+        if workers > 1:
+            tasks = []
+            for start, end in splittask(GroupStarts[-1], workers):
+                for i in range(NumGroup):  # a task can not go across groups
+                    first, last = max(start, GroupStarts[i]), min(end, GroupStarts[i + 1])
+                    if first < last:
+                        tasks.append((i, first - GroupStarts[i], last - GroupStarts[i], compare))
+            Results = runpool(testgrouprowsworker, tasks, workers, Data)
+        else:
+            Results = [testgrouprows(Data, i, 0, GroupSizes[i], compare) for i in range(NumGroup)]
+
+    AllResults = {}  # the value to return
+    with stage('testgroup/pack'):
+        for result in Results:
+            for key, (columns, p_values) in result:
+                AllResults[key] = packresult(Matrix.words, columns, p_values)
+    return AllResults
+
+
+def testgroup(GroupWordLists, option='CustomP', Low=0.0, High=1.0, vectorize=False, compare='group', workers=None,
+              Index=None):
     """
     this method takes ChunkWordlist and and then analyze each single word(compare to all the other group),
     and then pack that into the return
@@ -237,6 +643,21 @@ def testgroup(GroupWordLists, option='CustomP', Low=0.0, High=1.0):
     :param High: this method will only analyze the word with lower frequency than this value
                     (this parameter will be overwritten if the option is not 'Custom')
 
+    :param vectorize: use testgroupmatrix() to do all the z-test with array operation,
+                        this is much faster with a lot of group or chunk.
+
+    :param compare: 'group': compare each chunk to each other group (the number of comparison grows quadratically)
+                    'rest': compare each chunk to all the other groups merged together,
+                            the group number 2 in the return is then 'rest'
+                            (this always uses testgroupmatrix())
+
+    :param workers: the number of process to spread the chunks across (this implies vectorize),
+                    the result is exactly the same as vectorize=True in one process: the same p_values as the
+                    default (dictionary) way, but the words with the same p_value can be in a different order
+
+    :param Index: the FrequencyIndex of all the chunks in all the groups (see FrequencyIndex.fromwordlists()),
+                    made once and reused when the same groups are analyzed several times, default is making a new one
+
     :return:    contain a array
                 each element of array is a dictionary map a tuple to a list
                     tuple consist of 3 element (group number 1, list number, group number 2)
@@ -247,141 +668,172 @@ def testgroup(GroupWordLists, option='CustomP', Low=0.0, High=1.0):
                         compare to the word usage of the same word in group (group number 2)
     """
 
+    if vectorize or workers > 1 or compare != 'group':
+        return testgroupmatrix(GroupWordLists, option, Low, High, compare, workers, Index)
+
     # init
     GroupLists = []
     GroupWordCounts = []
-    GroupNumWords = []
     for Chunk in GroupWordLists:
         GroupLists.append(merge_list(Chunk))
         GroupWordCounts.append(sum(GroupLists[-1].values()))
-        GroupNumWords.append(len(GroupLists[-1]))
     TotalList = merge_list(GroupLists)
     TotalWordCount = sum(GroupWordCounts)
-    TotalNumWords = len(TotalList)
     AllResults = {}  # the value to return
 
     # option
-    if option == 'CustomP':
-        pass
+    with stage('testgroup/bound'):
+        if option == 'CustomF':
+            option, Low, High = 'CustomP', Low / TotalWordCount, High / TotalWordCount
+        if Index is None:
+            Index = FrequencyIndex.fromdict(TotalList)
+        Low, High = Index.bound(option, Low, High)
 
-    elif option == 'CustomF':
-        Low /= TotalWordCount
-        High /= TotalWordCount
+    # calculation
+    Counting = enabled()
+    with stage('testgroup/ztest'):
+        for i in range(len(GroupWordLists)):  # individual chunk
+            # the words of each chunk inside the band (with their proportion), the same for every group compared to
+            Chunks = []
+            for wordlist in GroupWordLists[i]:
+                iTotalWordCount = sum(wordlist.values())
+                Chunks.append((iTotalWordCount, [(word, wordlist[word] / iTotalWordCount) for word in wordlist.keys()
+                                                 if Low < wordlist[word] / iTotalWordCount < High]))
+            for j in range(len(GroupWordLists)):  # group compare
+                if i != j:  # each chunk in wordlist i, compare to each chunk in
+                    jTotalWordCount = GroupWordCounts[j]
+                    for wordlistnumber, (iTotalWordCount, Words) in enumerate(Chunks):
+                        for word, iWordProp in Words:
+                            jWordProp = GroupLists[j].get(word, 0) / jTotalWordCount
+                            p_value = ztest(iWordProp, jWordProp, iTotalWordCount, jTotalWordCount)
+                            try:
+                                AllResults[(i, wordlistnumber, j)].append((word, p_value))
+                            except KeyError:
+                                AllResults[(i, wordlistnumber, j)] = [(word, p_value)]
+    if Counting:
+        countresult([p_value for Result in AllResults.values() for word, p_value in Result],
+                    (len(GroupWordLists) - 1) * sum(len(wordlist) for Chunk in GroupWordLists for wordlist in Chunk))
 
-    elif option.endswith('StdE'):
-        StdE = 0
-        Average = TotalWordCount / TotalNumWords
-        for word in TotalList:
-            StdE += (TotalList[word] - Average) ** 2
-        StdE = sqrt(StdE)
-        StdE /= TotalNumWords
+    # sort the output
+    with stage('testgroup/sort'):
+        for tuple in AllResults.keys():
+            list = AllResults[tuple]
+            list = sorted(list, key=lambda tup: tup[1])
+            AllResults.update({tuple: list})
+    return AllResults
 
-        if option.startswith('Top'):
-            # TopStdE: only analyze the Right outlier of word, determined by standard deviation
-            Low = (Average + 2 * StdE) / TotalNumWords
 
-        elif option.startswith('Mid'):
-            # MidStdE: only analyze the Non-Outlier of word, determined by standard deviation
-            High = (Average + 2 * StdE) / TotalNumWords
-            Low = (Average - 2 * StdE) / TotalNumWords
+def rankcolumns(Values):
+    """
+    rank each column of a matrix (rank starts from 1, tied values get the average of their ranks),
+    all the columns are ranked with array operations at once
 
-        elif option.startswith('Low'):
-            # LowStdE: only analyze the Left Outlier of word, determined by standard deviation
-            High = (Average - 2 * StdE) / TotalNumWords
+    :param Values: a 2d numpy array
+    :return: (the rank of each value (the same shape as Values),
+                sum of (t^3 - t) of each column, t is the size of each group of tied values)
+    """
+    NumRow, NumCol = Values.shape
+    Order = np.argsort(Values, axis=0, kind='mergesort')
+    Sorted = np.take_along_axis(Values, Order, axis=0).T.ravel()  # column by column
+    New = np.ones(len(Sorted), dtype=bool)  # whether a value starts a new group of tied values
+    New[1:] = Sorted[1:] != Sorted[:-1]
+    New[::NumRow] = True  # a group never goes across columns
+    Starts = np.flatnonzero(New)
+    Sizes = np.diff(np.append(Starts, len(Sorted)))
+    AverageRanks = Starts % NumRow + (Sizes + 1) / 2
+    SortedRanks = AverageRanks[np.cumsum(New) - 1].reshape(NumCol, NumRow).T
+    Ranks = np.empty((NumRow, NumCol))
+    np.put_along_axis(Ranks, Order, SortedRanks, axis=0)
+    Ties = np.bincount(Starts // NumRow, weights=Sizes ** 3.0 - Sizes, minlength=NumCol)
+    return Ranks, Ties
+
+
+def kruskalcolumns(Values, Groups, NumGroup):
+    """
+    Kruskal-Wallis H-test (with tie correction, the same as scipy's mstats.kruskalwallis) on each column
 
-        else:
-            print('input error')
-            exit(-1)
+    :param Values: a 2d numpy array, each row is a sample (chunk), each column is a test (word)
+    :param Groups: an parallel array of the rows, the group number of each row
+    :param NumGroup: the number of group
+    :return: an array of the p_value of each column (nan if all the values of the column are the same)
+    """
+    from scipy.stats import chi2
+    NumRow = len(Values)
+    Ranks, Ties = rankcolumns(Values)
+    Indicator = np.zeros((NumGroup, NumRow))
+    Indicator[Groups, np.arange(NumRow)] = 1
+    RankSums = Indicator.dot(Ranks)
+    GroupSizes = Indicator.sum(axis=1)
+    H = 12 / (NumRow * (NumRow + 1)) * (RankSums ** 2 / GroupSizes[:, None]).sum(axis=0) - 3 * (NumRow + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H /= 1 - Ties / (NumRow ** 3 - NumRow)
+    return chi2.sf(H, NumGroup - 1)
+
+
+def kruskalblock(Values, start, end, Groups, NumGroup):
+    """
+    kruskalcolumns() for the columns from start to end of a sparse matrix,
+    only these columns are made dense
 
-    elif option.endswith('IQR'):
-        TempList = sorted(TotalList.items(), key=itemgetter(1))
-        Mid = TempList[int(TotalNumWords / 2)][1]
-        Q3 = TempList[int(TotalNumWords * 3 / 4)][1]
-        Q1 = TempList[int(TotalNumWords / 4)][1]
-        IQR = Q3 - Q1
+    :param Values: a scipy CSC matrix, each row is a chunk, each column is a word
+    """
+    return kruskalcolumns(Values[:, start:end].toarray().astype(float), Groups, NumGroup)
 
-        if option.startswith('Top'):
-            # TopIQR: only analyze the Top outlier of word, determined by IQR
-            Low = (Mid + 1.5 * IQR) / TotalWordCount
 
-        elif option.startswith('Mid'):
-            # MidIQR: only analyze the non-outlier of word, determined by IQR
-            High = (Mid + 1.5 * IQR) / TotalWordCount
-            Low = (Mid - 1.5 * IQR) / TotalWordCount
+def kruskalworker(task):
+    """
+    kruskalblock() for the columns from start to end in a worker process of workerpool.runpool()
+    """
+    from scipy.sparse import csc_matrix
+    start, end = task
+    Data = workerpool.SharedData
+    Values = csc_matrix((Data['data'], Data['indices'], Data['indptr']), shape=Data['shape'])
+    return kruskalblock(Values, start, end, Data['Groups'], Data['NumGroup'])
 
-        elif option.startswith('Low'):
-            # LowIQR: only analyze the Left outlier of word, determined by IQR
-            High = (Mid - 1.5 * IQR) / TotalWordCount
 
+def KWtest(Matrixs, Words, workers=None, blocksize=1024):
+    """
+    this method tests whether the usage of each word is different between groups of chunks, with Kruskal-Wallis test
+    all the words are ranked and tested with array operations, a block of words at a time
+
+    :param Matrixs: an array of the word matrix of each group,
+                    each matrix is an array of rows (chunk), the first element of each row is the label of the chunk,
+                    the rest are the word count of each word in Words
+                    (or a scipy sparse matrix / numpy array without the label column, see extra.dicttomatrix())
+    :param Words: the word of each column (not include the label column)
+    :param workers: the number of process to spread the words across
+    :param blocksize: the number of word tested at a time
+                        (the counts are kept sparse, only a block of words is made dense at a time)
+    :return: a dictionary map each word to its p_value
+                (the p_value is nan if the word has the same count in all the chunks)
+    """
+    from scipy.sparse import issparse, csr_matrix, vstack
+    GroupValues = []
+    for matrix in Matrixs:
+        if issparse(matrix):
+            GroupValues.append(matrix.tocsr())
+        elif isinstance(matrix, np.ndarray):
+            GroupValues.append(csr_matrix(matrix.reshape(-1, len(Words))))
         else:
-            print('input error')
-            exit(-1)
-
+            GroupValues.append(csr_matrix(np.array([row[1:] for row in matrix], dtype=float).reshape(-1, len(Words))))
+    Values = vstack([csr_matrix((0, len(Words)))] + GroupValues, format='csc')
+    Groups = np.repeat(np.arange(len(Matrixs)), [values.shape[0] for values in GroupValues])
+    tasks = [(start, min(start + blocksize, len(Words))) for start in range(0, len(Words), blocksize)]
+
+    if workers > 1:
+        pvalues = runpool(kruskalworker, tasks, workers,
+                          {'data': Values.data, 'indices': Values.indices, 'indptr': Values.indptr,
+                           'shape': Values.shape, 'Groups': Groups, 'NumGroup': len(Matrixs)})
     else:
-        print('input error')
-        exit(-1)
-
-    # calculation
-    for i in range(len(GroupWordLists)):  # individual chunk
-        for j in range(len(GroupWordLists)):  # group compare
-            if i != j:  # each chunk in wordlist i, compare to each chunk in
-                wordlistnumber = 0  # the label of the word list in GroupWordList[i]
-                for wordlist in GroupWordLists[i]:  # focusing on a specific word on list i.
-                    for word in wordlist.keys():
-                        iWordCount = wordlist[word]
-                        iTotalWordCount = sum(wordlist.values())
-                        iWordProp = iWordCount / iTotalWordCount
-                        try:
-                            jWordCount = GroupLists[j][word]
-                        except KeyError:
-                            jWordCount = 0
-                        jTotalWordCount = GroupWordCounts[j]
-                        jWordProp = jWordCount / jTotalWordCount
-                        if Low < iWordProp < High:
-                            p_value = ztest(iWordProp, jWordProp, iTotalWordCount, jTotalWordCount)
-                            try:
-                                AllResults[(i, wordlistnumber, j)].append((word, p_value))
-                            except:
-                                AllResults.update({(i, wordlistnumber, j): [(word, p_value)]})
-                    wordlistnumber += 1
-    # sort the output
-    for tuple in AllResults.keys():
-        list = AllResults[tuple]
-        list = sorted(list, key=lambda tup: tup[1])
-        AllResults.update({tuple: list})
-    return AllResults
+        pvalues = [kruskalblock(Values, start, end, Groups, len(Matrixs)) for start, end in tasks]
 
-def KWtest(Matrixs, Words):
-    Len = max(len(matrix) for matrix in Matrixs)
-    word_pvalue_dict = {}
-
-    for i in range(1, len(Matrixs[0][0])):
-        print Words[i-1]
-        samples = []
-        for k in range(len(Matrixs)):
-            print k
-            sample = []
-            for j in range(len(Matrixs[k])):
-                sample.append(Matrixs[k][j][i])
-            print sample
-            print
-            samples.append(ma.masked_array(sample + [0]*(Len - len(sample)),
-                                           mask=[0]*len(sample)+[1]*(Len-len(sample))))
-        print samples
-        pvalue = kruskalwallis(samples)[1]
-        print pvalue
-        word_pvalue_dict.update({Words[i-1]: pvalue})
-    print word_pvalue_dict
+    pvalues = np.concatenate(pvalues).tolist() if pvalues else []
+    return dict(zip(Words, pvalues))
 
 
 if __name__ == "__main__":
-    WordLists = []
-    for i in range(1, 9):
-        content = open('SHAKESPEARE_' + str(i) + '.txt').read()
-        WordLists.append(loadstastic(content))
-    for i in range(1, 7):
-        content = open('WILKINS_' + str(i) + '.txt').read()
-        WordLists.append(loadstastic(content))
+    WordLists, FileNames = loadcorpus(['SHAKESPEARE_' + str(i) + '.txt' for i in range(1, 9)] +
+                                      ['WILKINS_' + str(i) + '.txt' for i in range(1, 7)])
 
     for row in testall(WordLists, option='TopStdE'):
         print row
@@ -391,5 +843,5 @@ if __name__ == "__main__":
 
     Group = groupdivision(WordLists, [[0, 1, 2, 3, 4, 5, 6, 7], [8, 9, 10, 11, 12, 13]])
     print
-    for key in testgroup(Group, option='TopStdE').keys():
-        print key, testgroup(Group, option='TopStdE')[key]
+    for key, value in testgroup(Group, option='TopStdE').items():
+        print key, value
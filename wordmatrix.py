@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the array based representation of a corpus, it is an alternative to the WordLists (array of dictionaries)
+used everywhere else in this project.
+a corpus is represented as a document-term matrix: each row is a chunk, each column is a word,
+the columns are indexed by a word list (and a dictionary map from word to column number)
+the counts are stored in a scipy CSR matrix, so only the words actually inside the chunk take space.
+(scipy.sparse is only imported when a DocumentTermMatrix is made, Vocabulary and WordCounts only need numpy)
+"""
+import numpy as np
+
+
+class Vocabulary(object):
+    """
+    a shared word list, map each word to an integer id (the order the word is first added)
+    all the WordCounts of a corpus should share one Vocabulary, so each word is only stored once
+    """
+    __slots__ = ('words', 'index')
+
+    def __init__(self, words=()):
+        """
+        :param words: the words to add at the beginning
+        """
+        self.words = []  # the word of each id
+        self.index = {}  # map word to its id
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """
+        :return: the id of the word, the word is added if it is not in the vocabulary
+        """
+        try:
+            return self.index[word]
+        except KeyError:
+            word = intern(word) if isinstance(word, str) else word
+            self.index[word] = len(self.words)
+            self.words.append(word)
+            return self.index[word]
+
+    def addall(self, words):
+        """
+        :return: a numpy array of the id of each word, the words not in the vocabulary are added
+        """
+        add = self.add
+        return np.fromiter((add(word) for word in words), dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, id):
+        return self.words[id]
+
+    def __contains__(self, word):
+        return word in self.index
+
+
+class WordCounts(object):
+    """
+    a compact WordList (the dictionary map word to word count used everywhere in this project)
+    the words are kept as sorted ids of a Vocabulary, in a numpy array parallel to the counts
+    it supports the dictionary operation the rest of the project uses (keys, values, items, [word], in, len...)
+    """
+    __slots__ = ('vocabulary', 'ids', 'counts')
+
+    def __init__(self, vocabulary, ids, counts):
+        """
+        :param vocabulary: the Vocabulary the ids refer to
+        :param ids: a numpy array of word id, sorted and no repeat
+        :param counts: a numpy array parallel to ids, the count of each word
+                        (integer counts are stored as uint32, or int64 if they do not fit in uint32)
+        """
+        counts = np.asarray(counts)
+        self.vocabulary = vocabulary
+        self.ids = np.asarray(ids, dtype=np.uint32)
+        if counts.dtype.kind in 'iub':
+            # uint32 is enough for the counts of a chunk, but a merged count can be larger, then int64 is kept
+            Fits = len(counts) == 0 or (counts.min() >= 0 and counts.max() <= np.iinfo(np.uint32).max)
+            counts = counts.astype(np.uint32 if Fits else np.int64)
+        self.counts = counts
+
+    @classmethod
+    def fromtokens(cls, tokens, vocabulary):
+        """
+        count the tokens
+
+        :param tokens: an array of words
+        :param vocabulary: the Vocabulary to use (the new words are added to it)
+        :return: the WordCounts of the tokens
+        """
+        ids, counts = np.unique(vocabulary.addall(tokens), return_counts=True)
+        return cls(vocabulary, ids, counts)
+
+    @classmethod
+    def fromdict(cls, wordlist, vocabulary):
+        """
+        convert a WordList (a dictionary map word to word count) into WordCounts
+
+        :param vocabulary: the Vocabulary to use (the new words are added to it)
+        """
+        ids = vocabulary.addall(wordlist.iterkeys())
+        counts = np.array(wordlist.values())
+        order = np.argsort(ids)
+        return cls(vocabulary, ids[order], counts[order])
+
+    @classmethod
+    def merge(cls, wordcounts):
+        """
+        merge an array of WordCounts (with the same Vocabulary) into one, see extra.merge_list()
+        """
+        ids = np.concatenate([wordcount.ids for wordcount in wordcounts])
+        counts = np.concatenate([wordcount.counts for wordcount in wordcounts])
+        if counts.dtype.kind == 'u':
+            counts = counts.astype(np.int64)  # the sum can be larger than uint32
+        order = np.argsort(ids, kind='mergesort')
+        ids, counts = ids[order], counts[order]
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1]))) if len(ids) else np.zeros(0, int)
+        return cls(wordcounts[0].vocabulary, ids[starts], np.add.reduceat(counts, starts) if len(ids) else counts)
+
+    def find(self, word):
+        """
+        :return: the position of the word in self.ids, -1 if it is not in this WordCounts
+        """
+        id = self.vocabulary.index.get(word)
+        if id is None:
+            return -1
+        position = np.searchsorted(self.ids, id)
+        return position if position < len(self.ids) and self.ids[position] == id else -1
+
+    def __getitem__(self, word):
+        position = self.find(word)
+        if position < 0:
+            raise KeyError(word)
+        return self.counts[position].item()
+
+    def get(self, word, default=None):
+        position = self.find(word)
+        return default if position < 0 else self.counts[position].item()
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        words = self.vocabulary.words
+        return [words[id] for id in self.ids.tolist()]
+
+    def values(self):
+        return self.counts.tolist()
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def todict(self):
+        """
+        :return: the WordList (dictionary) of this WordCounts
+        """
+        return dict(self.items())
+
+    def __eq__(self, other):
+        return dict(self.items()) == (other.todict() if isinstance(other, WordCounts) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'WordCounts(' + repr(self.todict()) + ')'
+
+
+class DocumentTermMatrix(object):
+    def __init__(self, counts, words):
+        """
+        pack a count matrix and its word list into a DocumentTermMatrix
+
+        :param counts: a CSR matrix (or anything scipy can convert to a CSR matrix),
+                        each row represent a chunk, each column represent a word
+        :param words: an array parallel to the columns of counts, contain the word of each column
+        """
+        from scipy.sparse import csr_matrix, issparse
+        if not issparse(counts):
+            counts = csr_matrix(counts)
+        self.counts = counts.tocsr()  # the count matrix, in CSR format
+        self.words = list(words)  # the word of each column
+        self.index = dict((word, i) for i, word in enumerate(self.words))  # map word to column number
+
+    @classmethod
+    def fromwordlists(cls, WordLists):
+        """
+        convert WordLists into a DocumentTermMatrix
+        the columns are in the order that each word first appear in the WordLists
+
+        :param WordLists: an array contain dictionaries map from word to word count
+                            each dictionary is word count of a particular chunk
+        :return: the DocumentTermMatrix of the WordLists
+        """
+        from scipy.sparse import csr_matrix
+        if len(WordLists) and all(isinstance(wordlist, WordCounts) and
+                                  wordlist.vocabulary is WordLists[0].vocabulary for wordlist in WordLists):
+            # the ids are already the column number
+            counts = csr_matrix((np.concatenate([wordlist.counts for wordlist in WordLists]),
+                                 np.concatenate([wordlist.ids for wordlist in WordLists]).astype(np.intp),
+                                 np.cumsum([0] + [len(wordlist) for wordlist in WordLists]).astype(np.intp)),
+                                shape=(len(WordLists), len(WordLists[0].vocabulary)))
+            return cls(counts, WordLists[0].vocabulary.words)
+
+        index = {}
+        words = []
+        indptr = [0]
+        indices = []
+        data = []
+        for wordlist in WordLists:
+            for word, count in wordlist.iteritems():
+                try:
+                    indices.append(index[word])
+                except KeyError:
+                    index[word] = len(words)
+                    indices.append(len(words))
+                    words.append(word)
+                data.append(count)
+            indptr.append(len(indices))
+
+        counts = csr_matrix((np.array(data), np.array(indices, dtype=np.intp), np.array(indptr, dtype=np.intp)),
+                            shape=(len(WordLists), len(words)))
+        # keep the columns of each row in order, the count of zero (if there is any) are kept on purpose
+        counts.has_sorted_indices = False
+        counts.sort_indices()
+        return cls(counts, words)
+
+    @classmethod
+    def frommatrix(cls, matrix):
+        """
+        convert a word matrix(which is generated in getMatirx() method in ModelClass.py) to a DocumentTermMatrix
+        (this is the same matrix that extra.matrixtodict() takes)
+        every cell in the matrix is kept (even the 0), so that the result is the same as using matrixtodict()
+
+        :param matrix: the count matrix generated by getMatrix method
+                        the first row is the word list (the first element is not a word)
+                        the first column is the label of the chunk
+        :return: the DocumentTermMatrix of the matrix
+        """
+        from scipy.sparse import csr_matrix
+        words = matrix[0][1:]
+        dense = np.array([row[1:] for row in matrix[1:]])
+        NumRow, NumCol = len(matrix) - 1, len(words)
+        dense = dense.reshape(NumRow, NumCol)
+        counts = csr_matrix((dense.ravel(), np.tile(np.arange(NumCol, dtype=np.intp), NumRow),
+                             np.arange(NumRow + 1, dtype=np.intp) * NumCol),
+                            shape=(NumRow, NumCol))
+        return cls(counts, words)
+
+    @classmethod
+    def load(cls, data):
+        """
+        convert whatever we have in hand into a DocumentTermMatrix
+
+        :param data: a DocumentTermMatrix, WordLists (array of dictionaries or WordCounts)
+                        or the matrix generated by getMatrix method (see frommatrix())
+        :return: the DocumentTermMatrix of the data
+        """
+        if isinstance(data, cls):
+            return data
+        if len(data) == 0 or isinstance(data[0], (dict, WordCounts)):
+            return cls.fromwordlists(data)
+        return cls.frommatrix(data)
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+    def totals(self):
+        """
+        :return: an array contain the total word count of each chunk
+        """
+        return np.asarray(self.counts.sum(axis=1)).ravel()
+
+    def mergecounts(self):
+        """
+        the array version of extra.merge_list()
+
+        :return: an array parallel to self.words, contain the word count of each word in all the chunks
+        """
+        return np.asarray(self.counts.sum(axis=0)).ravel()
+
+    def row(self, i):
+        """
+        :param i: the row number (chunk number)
+        :return: (the column number of the word in the chunk, the corresponding word count)
+        """
+        start, end = self.counts.indptr[i], self.counts.indptr[i + 1]
+        return self.counts.indices[start:end], self.counts.data[start:end]
+
+    def todicts(self):
+        """
+        convert back to WordLists
+
+        :return: an array contain dictionaries map from word to word count
+        """
+        words = self.words
+        WordLists = []
+        for i in range(len(self)):
+            columns, values = self.row(i)
+            WordLists.append(dict(zip([words[column] for column in columns], values.tolist())))
+        return WordLists
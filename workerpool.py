@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+"""
+this is the process pool used to spread the chunk level work in this project across cores.
+the large read only arrays (the merged counts, the count matrix...) are put in shared memory once,
+every worker process maps them when it starts (see initworker()), so the only thing sent with each task is
+the small task description (usually a range of chunk number).
+"""
+import ctypes
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+SharedData = {}  # the shared arrays of the current worker process, map name to numpy array
+
+
+def sharearray(array):
+    """
+    copy an numpy array into shared memory
+
+    :param array: the array to share
+    :return: (the shared memory, the dtype of the array, the shape of the array),
+                this can be passed to a worker process when it starts (see initworker())
+    """
+    array = np.ascontiguousarray(array)
+    memory = RawArray(ctypes.c_char, array.nbytes)
+    np.frombuffer(memory, dtype=np.uint8).view(array.dtype)[:] = array.ravel()
+    return memory, array.dtype.str, array.shape
+
+
+def initworker(SharedArrays, Extra):
+    """
+    the initializer of the worker process, map all the shared arrays into SharedData
+
+    :param SharedArrays: a dictionary map name to the result of sharearray()
+    :param Extra: a dictionary of small read only data (this is pickled once for every worker)
+    """
+    SharedData.clear()
+    for name, (memory, dtype, shape) in SharedArrays.items():
+        SharedData[name] = np.frombuffer(memory, dtype=np.uint8).view(np.dtype(dtype)).reshape(shape)
+    SharedData.update(Extra)
+
+
+def runpool(function, tasks, workers, Data=None):
+    """
+    run function on all the tasks with a process pool, the result is in the same order as the tasks
+
+    :param function: a module level function takes one task, it reads the shared data from SharedData
+    :param tasks: an array of the task (should be small, since they are pickled)
+    :param workers: the number of worker process
+    :param Data: a dictionary map name to the read only data needed by the function,
+                    the numpy arrays are put into shared memory, other values are sent to each worker once
+    :return: an array of the result of each task
+    """
+    Data = Data or {}
+    SharedArrays = dict((name, sharearray(value)) for name, value in Data.items() if isinstance(value, np.ndarray))
+    Extra = dict((name, value) for name, value in Data.items() if not isinstance(value, np.ndarray))
+    pool = Pool(workers, initializer=initworker, initargs=(SharedArrays, Extra))
+    try:
+        return pool.map(function, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def splittask(total, workers, pieces=4):
+    """
+    split range(total) into about (workers * pieces) continuous pieces
+
+    :return: an array of (start, end)
+    """
+    size = max(1, -(-total // (max(workers, 1) * pieces)))
+    return [(start, min(start + size, total)) for start in range(0, total, size)]